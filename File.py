@@ -1,10 +1,30 @@
 import os
+
+# Cooperative I/O: with gevent, blocking Salesforce/Telegram calls yield to
+# other requests. This has to patch before requests/flask are imported.
+# (Under gunicorn, `-k gevent` patches by itself.)
+USE_GEVENT = os.getenv('USE_GEVENT', 'false').lower() == 'true'
+if USE_GEVENT:
+    from gevent import monkey
+    monkey.patch_all()
+
 import logging
+import logging.handlers
+import queue
 import requests
 import time
+import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import re
-import json
+import socket
+import orjson
+import redis
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 
 # Configuration with validation
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -13,6 +33,17 @@ SF_INSTANCE_URL = os.getenv('SF_INSTANCE_URL')
 SF_CLIENT_ID = os.getenv('SF_CLIENT_ID')
 SF_CLIENT_SECRET = os.getenv('SF_CLIENT_SECRET')
 PORT = int(os.getenv('PORT', 10000))
+SF_API_PATH = '/services/data/v58.0'
+REDIS_URL = os.getenv('REDIS_URL')
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', 900))  # seconds
+CONTACT_CACHE_TTL = int(os.getenv('CONTACT_CACHE_TTL', 300))  # seconds
+CONTACT_ETAG_TTL = int(os.getenv('CONTACT_ETAG_TTL', 86400))  # seconds
+THREAD_CACHE_TTL = int(os.getenv('THREAD_CACHE_TTL', 60))  # seconds
+TCP_KEEPIDLE = int(os.getenv('TCP_KEEPIDLE', 60))  # seconds
+SF_POOL_MAXSIZE = int(os.getenv('SF_POOL_MAXSIZE', 50))
+UPDATE_SHARDS = int(os.getenv('UPDATE_SHARDS', 16))
+IO_WORKERS = int(os.getenv('IO_WORKERS', 32))
+SF_TOKEN_TTL = int(os.getenv('SF_TOKEN_TTL', 3600))  # seconds, if Salesforce doesn't say
 
 # Validate required environment variables
 missing_vars = []
@@ -27,34 +58,345 @@ if not SF_CLIENT_ID:
 if not SF_CLIENT_SECRET:
     missing_vars.append('SF_CLIENT_SECRET')
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for request parsing and jsonify"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configure logging
+# Request threads only enqueue log records; a listener thread does the
+# formatting and the (possibly blocking) write to stderr
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# The queue handler only merges the message arguments; the listener applies the real format
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    handlers=[queue_handler],
+    force=True
 )
 logger = logging.getLogger(__name__)
 
-# In-memory storage for user states
-user_states = {}
+# TCP keepalive probes stop NATs and load balancers from silently dropping
+# pooled connections during quiet periods
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    KEEPALIVE_SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_KEEPIDLE),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4),
+    ]
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets have TCP keepalive enabled"""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+def make_http_session(pool_maxsize=50):
+    """Session with a keep-alive pool so repeat calls skip the TCP/TLS handshake.
+
+    Only idempotent methods are retried by the adapter. Over HTTP/1.1 each
+    in-flight request holds its own connection, so pool_maxsize should cover
+    the concurrent calls to one host.
+    """
+    session = requests.Session()
+    session.mount('https://', KeepAliveAdapter(
+        pool_connections=20,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+    ))
+    return session
+
+# One pooled session per upstream. Closed at exit; atexit runs in reverse
+# order, so this happens after the forward executors below have drained.
+sf_session = make_http_session(SF_POOL_MAXSIZE)
+tg_session = make_http_session()
+atexit.register(sf_session.close)
+atexit.register(tg_session.close)
+
+class SessionStore:
+    """Per-chat conversation state, kept in Redis so all workers share it.
+
+    Falls back to a process-local dict when REDIS_URL is not set. That dict
+    drops expired entries as it goes and holds at most max_local of them.
+    """
+    def __init__(self, client=None, ttl=USER_STATE_TTL, prefix='ustate:', max_local=10000):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.max_local = max_local
+        self.local = {}  # {key: (expires_at, state)}, oldest write first
+        self.lock = threading.Lock()
+    
+    def get(self, chat_id):
+        if self.client is None:
+            key = str(chat_id)
+            with self.lock:
+                entry = self.local.get(key)
+                if entry is None:
+                    return None
+                if time.time() >= entry[0]:
+                    del self.local[key]
+                    return None
+                return entry[1]
+        raw = self.client.get(f"{self.prefix}{chat_id}")
+        return orjson.loads(raw) if raw is not None else None
+    
+    def set(self, chat_id, state):
+        if self.client is None:
+            with self.lock:
+                self._store_local(str(chat_id), state)
+        else:
+            self.client.setex(f"{self.prefix}{chat_id}", self.ttl, orjson.dumps(state))
+    
+    def delete(self, chat_id):
+        if self.client is None:
+            with self.lock:
+                self.local.pop(str(chat_id), None)
+        else:
+            self.client.delete(f"{self.prefix}{chat_id}")
+    
+    def claim(self, key):
+        """Atomically mark key as taken for ttl seconds; False if it already was"""
+        if self.client is not None:
+            return bool(self.client.set(f"{self.prefix}{key}", '1', nx=True, ex=self.ttl))
+        with self.lock:
+            entry = self.local.get(str(key))
+            if entry is not None and time.time() < entry[0]:
+                return False
+            self._store_local(str(key), True)
+            return True
+    
+    def _store_local(self, key, value):
+        """Write to the local dict, making room first; caller holds self.lock"""
+        current_time = time.time()
+        # Re-insert so the dict stays ordered by write time
+        self.local.pop(key, None)
+        if len(self.local) >= self.max_local:
+            self.local = {k: v for k, v in self.local.items() if v[0] > current_time}
+            # Still full of live entries: evict the oldest writes
+            while len(self.local) >= self.max_local:
+                del self.local[next(iter(self.local))]
+        self.local[key] = (current_time + self.ttl, value)
+
+# Shared Redis connection pool (optional)
+redis_client = None
+if REDIS_URL:
+    redis_client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+        REDIS_URL, max_connections=50, decode_responses=True,
+        socket_keepalive=True, health_check_interval=30
+    ))
+
+# Storage for user states
+user_states = SessionStore(redis_client)
+
+# Contact lookups, so each webhook doesn't repeat the same SOQL query.
+# Chat ID lookups also cache misses (stored as False) until the chat registers;
+# phone/email lookups only cache matches.
+contact_cache = SessionStore(redis_client, ttl=CONTACT_CACHE_TTL, prefix='contact:')
+contact_phone_cache = SessionStore(redis_client, ttl=CONTACT_CACHE_TTL, prefix='contact:phone:')
+contact_email_cache = SessionStore(redis_client, ttl=CONTACT_CACHE_TTL, prefix='contact:email:')
+
+# Last known contact record and ETag per chat, kept well past the cache TTL so
+# an expired entry can be revalidated with a conditional GET (304, no body)
+contact_etag_cache = SessionStore(redis_client, ttl=CONTACT_ETAG_TTL, prefix='contact:etag:')
+
+# Latest conversation thread per chat (False when there is none). Dropped
+# whenever a forward or an agent reply may have changed it.
+thread_cache = SessionStore(redis_client, ttl=THREAD_CACHE_TTL, prefix='thread:')
+
+# Telegram redelivers updates when a webhook is slow or fails; remember the
+# ones already handled. Contact creation is also claimed per chat so a
+# repeated name message can't create the contact twice.
+seen_updates = SessionStore(redis_client, ttl=3600, prefix='tg:seen:')
+contact_create_locks = SessionStore(redis_client, ttl=30, prefix='lock:create:')
+
+SALUTATIONS = {'male': 'Mr.', 'female': 'Ms.'}
+
+def escape_soql(value):
+    """Escape a value for use inside a quoted SOQL string literal"""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+# Query builders. Kept on one line: the text is sent URL-encoded, where every
+# indentation space would cost three bytes.
+def contact_phone_query(clean_phone):
+    phone = escape_soql(clean_phone)
+    return (
+        "SELECT Id, FirstName, LastName, Salutation, Phone, MobilePhone, Email FROM Contact "
+        f"WHERE Phone LIKE '%{phone}' OR MobilePhone LIKE '%{phone}' LIMIT 1"
+    )
+
+def contact_email_query(email):
+    return f"SELECT Id, FirstName, LastName, Salutation, Phone, Email FROM Contact WHERE Email = '{escape_soql(email)}' LIMIT 1"
+
+def contact_chat_query(chat_id):
+    return f"SELECT Id, FirstName, LastName, Salutation FROM Contact WHERE Telegram_Chat_ID__c = '{escape_soql(chat_id)}' LIMIT 1"
+
+def thread_query(chat_id):
+    return (
+        "SELECT Id, Status__c, Assigned__c FROM Conversation_Thread__c "
+        f"WHERE Telegram_Chat_ID__c = '{escape_soql(chat_id)}' AND Channel_Type__c = 'Telegram' "
+        "ORDER BY CreatedDate DESC LIMIT 1"
+    )
+
+def composite_query(query, reference_id):
+    """Composite API subrequest running a SOQL query"""
+    return {
+        'method': 'GET',
+        'url': f"{SF_API_PATH}/query?q={requests.utils.quote(query)}",
+        'referenceId': reference_id
+    }
 
 class SalesforceAuth:
-    """Handles Salesforce OAuth 2.0 authentication"""
-    def __init__(self):
+    """Handles Salesforce OAuth 2.0 authentication.
+
+    With Redis configured the token is shared by every worker under
+    sf:token, so only one of them mints a new one at a time.
+    """
+    TOKEN_KEY = 'sf:token'
+    LOCK_KEY = 'sf:token:lock'
+    MIN_SHARED_TTL = 300  # seconds left before a shared token is refreshed
+    LOCAL_RECHECK = 30  # seconds between Redis checks for a rotated token
+    
+    def __init__(self, client=None):
         self.instance_url = SF_INSTANCE_URL
         self.client_id = SF_CLIENT_ID
         self.client_secret = SF_CLIENT_SECRET
+        self.client = client
         self.access_token = None
         self.token_expiry = 0
+        self.checked_at = 0
+        self.lock = threading.Lock()
     
-    def get_access_token(self):
-        """Get Salesforce access token using client_credentials flow"""
-        try:
-            if self.access_token and time.time() < (self.token_expiry - 300):
-                logger.info("✅ Using cached Salesforce access token")
+    def _is_fresh(self):
+        current_time = time.time()
+        if not self.access_token or current_time >= (self.token_expiry - 60):
+            return False
+        return self.client is None or current_time < self.checked_at + self.LOCAL_RECHECK
+    
+    def get_access_token(self, force=False):
+        """Get Salesforce access token using client_credentials flow.
+
+        The background refresher keeps the token warm, so requests only
+        fetch one inline when it is (nearly) expired.
+        """
+        if not force and self._is_fresh():
+            logger.debug("✅ Using cached Salesforce access token")
+            return self.access_token
+        
+        with self.lock:
+            # Another thread may have refreshed while we waited
+            if not force and self._is_fresh():
                 return self.access_token
             
+            # On a forced refresh, a token another worker already rotated is fine
+            stale = self.access_token if force else None
+            if self.client is not None:
+                token = self._load_shared_token()
+                if token and token != stale:
+                    return token
+            return self._request_access_token(stale)
+    
+    def refresh_if_expiring(self):
+        """Mint a new token only when the current one is close to expiry.
+
+        With Redis, "current" is the shared token, and the refresh lock lets
+        one worker mint while the others adopt its token.
+        """
+        with self.lock:
+            if self.client is not None:
+                # None once the shared token is missing or under MIN_SHARED_TTL
+                token = self._load_shared_token()
+                if token:
+                    return token
+            elif self.access_token and time.time() < self.token_expiry - 60 - self.MIN_SHARED_TTL:
+                return self.access_token
+            return self._request_access_token(self.access_token)
+    
+    def invalidate(self, token):
+        """Drop a token Salesforce has rejected, unless it was already replaced"""
+        with self.lock:
+            if self.access_token == token:
+                self.access_token = None
+                self.token_expiry = 0
+            if self.client is not None:
+                try:
+                    if self.client.get(self.TOKEN_KEY) == token:
+                        self.client.delete(self.TOKEN_KEY)
+                except redis.RedisError as e:
+                    logger.warning("⚠️ Could not drop shared Salesforce token: %s", e)
+    
+    def _load_shared_token(self):
+        """Adopt the token in Redis if it has enough life left"""
+        try:
+            pipe = self.client.pipeline()
+            pipe.get(self.TOKEN_KEY)
+            pipe.ttl(self.TOKEN_KEY)
+            token, ttl = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("⚠️ Could not read shared Salesforce token: %s", e)
+            return None
+        
+        self.checked_at = time.time()
+        if token is None or ttl < self.MIN_SHARED_TTL:
+            return None
+        # The shared copy expires 60s before the token itself
+        self.access_token = token
+        self.token_expiry = self.checked_at + ttl + 60
+        return token
+    
+    def _claim_refresh(self, stale):
+        """Take the refresh lock, or wait for the worker holding it.
+
+        Returns (have_lock, token); token is set when another worker
+        published a new one while we waited.
+        """
+        try:
+            if self.client.set(self.LOCK_KEY, '1', nx=True, ex=30):
+                return True, None
+        except redis.RedisError as e:
+            logger.warning("⚠️ Could not take Salesforce token lock: %s", e)
+            return False, None
+        
+        for _ in range(20):
+            time.sleep(0.25)
+            token = self._load_shared_token()
+            if token and token != stale:
+                return False, token
+        return False, None
+    
+    def _publish_token(self, expires_in):
+        """Share a freshly minted token with the other workers"""
+        try:
+            self.client.setex(self.TOKEN_KEY, max(1, expires_in - 60), self.access_token)
+        except redis.RedisError as e:
+            logger.warning("⚠️ Could not share Salesforce token: %s", e)
+    
+    def _request_access_token(self, stale=None):
+        have_lock = False
+        if self.client is not None:
+            have_lock, token = self._claim_refresh(stale)
+            if token:
+                return token
+        
+        try:
             token_url = f"{self.instance_url}/services/oauth2/token"
             payload = {
                 'grant_type': 'client_credentials',
@@ -65,21 +407,33 @@ class SalesforceAuth:
             headers = {'Content-Type': 'application/x-www-form-urlencoded'}
             
             logger.info("🔑 Requesting Salesforce access token...")
-            response = requests.post(token_url, data=payload, headers=headers, timeout=30)
+            response = sf_session.post(token_url, data=payload, headers=headers, timeout=30)
             
             if response.status_code == 200:
-                token_data = response.json()
+                token_data = orjson.loads(response.content)
+                # client_credentials responses often omit expires_in; a token
+                # revoked earlier than assumed is caught by the 401 retry
+                expires_in = int(token_data.get('expires_in', SF_TOKEN_TTL))
+                self.token_expiry = time.time() + expires_in
                 self.access_token = token_data['access_token']
-                self.token_expiry = time.time() + token_data.get('expires_in', 3600)
+                self.checked_at = time.time()
+                if self.client is not None:
+                    self._publish_token(expires_in)
                 logger.info("✅ Salesforce access token acquired")
                 return self.access_token
             else:
-                logger.error(f"❌ Token request failed: {response.status_code} - {response.text}")
+                logger.error("❌ Token request failed: %s - %s", response.status_code, response.text)
                 return None
                 
         except Exception as e:
-            logger.error(f"❌ Token exception: {e}")
+            logger.error("❌ Token exception: %s", e)
             return None
+        finally:
+            if have_lock:
+                try:
+                    self.client.delete(self.LOCK_KEY)
+                except redis.RedisError:
+                    pass
 
 class TelegramBotManager:
     def __init__(self):
@@ -90,7 +444,52 @@ class TelegramBotManager:
             self.base_url = None
             
         self.sf_webhook = SALESFORCE_WEBHOOK_URL
-        self.sf_auth = SalesforceAuth()
+        self.sf_auth = SalesforceAuth(redis_client)
+        self.query_url = f"{SF_INSTANCE_URL}{SF_API_PATH}/query"
+        self.composite_url = f"{SF_INSTANCE_URL}{SF_API_PATH}/composite"
+        self.contact_url = f"{SF_INSTANCE_URL}{SF_API_PATH}/sobjects/Contact"
+        self.cached_headers = (None, None)  # (access_token, headers)
+    
+    def _auth_headers(self):
+        """Salesforce request headers; rebuilt only when the token rotates"""
+        access_token = self.sf_auth.get_access_token()
+        if not access_token:
+            return None
+        token, headers = self.cached_headers
+        if token != access_token:
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            self.cached_headers = (access_token, headers)
+        return headers
+    
+    def _sf_call(self, method, url, headers, **kwargs):
+        """Send a Salesforce API request, retrying once with a new token on 401"""
+        response = sf_session.request(method, url, headers=headers, timeout=30, **kwargs)
+        if response.status_code != 401:
+            return response
+        
+        logger.warning("🔑 Salesforce rejected the access token, refreshing")
+        self.sf_auth.invalidate(headers['Authorization'][len('Bearer '):])
+        fresh = self._auth_headers()
+        if not fresh:
+            return response
+        # Keep per-request headers such as If-None-Match
+        return sf_session.request(method, url, headers={**headers, **fresh}, timeout=30, **kwargs)
+    
+    def _query_first(self, query, headers=None):
+        """Run a SOQL query and return the first record, or None if nothing matched.
+
+        Raises on HTTP errors so callers can tell a miss from a failed lookup.
+        """
+        headers = headers or self._auth_headers()
+        if not headers:
+            return None
+        response = self._sf_call('GET', self.query_url, headers, params={'q': query})
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        return data['records'][0] if data['totalSize'] > 0 else None
         
     def send_message(self, chat_id, text, reply_markup=None):
         """Send message to Telegram using direct API"""
@@ -107,20 +506,20 @@ class TelegramBotManager:
             }
             
             if reply_markup:
-                data['reply_markup'] = json.dumps(reply_markup)
+                data['reply_markup'] = orjson.dumps(reply_markup).decode()
             
-            response = requests.post(url, data=data, timeout=30)
-            result = response.json()
+            response = tg_session.post(url, data=data, timeout=30)
+            result = orjson.loads(response.content)
             
             if result.get('ok'):
-                logger.info(f"✅ Message sent to {chat_id}")
+                logger.info("✅ Message sent to %s", chat_id)
                 return True
             else:
-                logger.error(f"❌ Failed to send to {chat_id}: {result.get('description')}")
+                logger.error("❌ Failed to send to %s: %s", chat_id, result.get('description'))
                 return False
                 
         except Exception as e:
-            logger.error(f"❌ Failed to send to {chat_id}: {e}")
+            logger.error("❌ Failed to send to %s: %s", chat_id, e)
             return False
     
     def forward_to_salesforce(self, payload):
@@ -131,275 +530,448 @@ class TelegramBotManager:
                 return False
             
             # Get Salesforce access token
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 logger.error("❌ Failed to get Salesforce access token")
                 return False
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            logger.info("📤 Forwarding to Salesforce: %s", self.sf_webhook)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📤 Payload: %s", orjson.dumps(payload).decode())
             
-            logger.info(f"📤 Forwarding to Salesforce: {self.sf_webhook}")
+            # Serialized with orjson; headers already carry the JSON content type
+            response = self._sf_call('POST', self.sf_webhook, headers, data=orjson.dumps(payload))
+            # Salesforce may have opened or moved the thread for this message
+            thread_cache.delete(payload['chatId'])
             
-            response = requests.post(
-                self.sf_webhook, 
-                json=payload, 
-                headers=headers, 
-                timeout=30
-            )
-            
-            logger.info(f"📤 Salesforce response: {response.status_code}")
+            logger.info("📤 Salesforce response: %s", response.status_code)
             
             if response.status_code == 200:
-                logger.info(f"✅ Forwarded to Salesforce: {payload.get('chatId')}")
+                logger.info("✅ Forwarded to Salesforce: %s", payload.get('chatId'))
                 return True
             else:
-                logger.error(f"❌ Salesforce error {response.status_code}: {response.text}")
+                logger.error("❌ Salesforce error %s: %s", response.status_code, response.text)
                 return False
                 
         except Exception as e:
-            logger.error(f"❌ Error forwarding to Salesforce: {e}")
+            logger.error("❌ Error forwarding to Salesforce: %s", e)
             return False
     
     def check_existing_contact(self, chat_id):
         """Check if contact exists in Salesforce by Telegram Chat ID"""
+        cached = contact_cache.get(chat_id)
+        if cached is not None:
+            return cached or None
+        
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            query = f"SELECT Id, FirstName, LastName, Salutation FROM Contact WHERE Telegram_Chat_ID__c = '{chat_id}' LIMIT 1"
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
+            # A contact seen before can be revalidated without re-running the query
+            known = contact_etag_cache.get(chat_id)
+            if known:
+                contact = self._revalidate_contact(known, chat_id, headers)
+                if contact:
+                    contact_cache.set(chat_id, contact)
+                    return contact
             
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['totalSize'] > 0:
-                    return data['records'][0]
-            return None
+            contact = self._query_first(contact_chat_query(chat_id), headers)
+            contact_cache.set(chat_id, contact or False)
+            if contact:
+                contact_etag_cache.set(chat_id, {'record': contact, 'etag': None})
+            return contact
             
         except Exception as e:
-            logger.error(f"❌ Error checking contact: {e}")
+            logger.error("❌ Error checking contact: %s", e)
             return None
     
+    def _revalidate_contact(self, known, chat_id, headers):
+        """Conditional GET of a previously seen contact.
+
+        Returns the contact if it is still linked to this chat (the cached copy
+        on 304 Not Modified), or None if the caller should query again.
+        """
+        record = known['record']
+        request_headers = dict(headers)
+        if known.get('etag'):
+            request_headers['If-None-Match'] = known['etag']
+        
+        response = self._sf_call(
+            'GET',
+            f"{self.contact_url}/{record['Id']}",
+            request_headers,
+            params={'fields': 'Id,FirstName,LastName,Salutation,Telegram_Chat_ID__c'}
+        )
+        
+        if response.status_code == 304:
+            contact_etag_cache.set(chat_id, known)
+            return record
+        if response.status_code == 200:
+            fresh = orjson.loads(response.content)
+            if fresh.get('Telegram_Chat_ID__c') == str(chat_id):
+                contact_etag_cache.set(chat_id, {'record': fresh, 'etag': response.headers.get('ETag')})
+                return fresh
+        
+        contact_etag_cache.delete(chat_id)
+        return None
+    
     def get_thread_status(self, chat_id):
         """Get conversation thread status from Salesforce"""
+        cached = thread_cache.get(chat_id)
+        if cached is not None:
+            return cached or None
+        
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            thread = self._query_first(thread_query(chat_id), headers)
+            thread_cache.set(chat_id, thread or False)
+            return thread
+            
+        except Exception as e:
+            logger.error("❌ Error getting thread status: %s", e)
+            return None
+    
+    def fetch_user_context(self, chat_id):
+        """Contact and latest thread for a chat, in at most one Salesforce round trip.
+
+        Returns (contact, thread); both are None for an unregistered chat.
+        Cached values are used where present. When neither is cached both
+        queries go out in one composite request.
+        """
+        contact = contact_cache.get(chat_id)
+        if contact is False:
+            return None, None
+        thread = thread_cache.get(chat_id)
+        
+        if contact is None and thread is None:
+            return self._fetch_contact_and_thread(chat_id)
+        
+        if contact is None:
+            contact = self.check_existing_contact(chat_id)
+            if not contact:
+                return None, None
+        if thread is None:
+            thread = self.get_thread_status(chat_id)
+        return contact, thread or None
+    
+    def _fetch_contact_and_thread(self, chat_id):
+        try:
+            headers = self._auth_headers()
+            if not headers:
+                return None, None
             
-            query = f"""
-            SELECT Id, Status__c, Assigned__c 
-            FROM Conversation_Thread__c 
-            WHERE Telegram_Chat_ID__c = '{chat_id}' 
-            AND Channel_Type__c = 'Telegram'
-            ORDER BY CreatedDate DESC 
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
+            data = {
+                'allOrNone': False,
+                'compositeRequest': [
+                    composite_query(contact_chat_query(chat_id), 'contact'),
+                    composite_query(thread_query(chat_id), 'thread')
+                ]
+            }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self._sf_call('POST', self.composite_url, headers, data=orjson.dumps(data))
             
             if response.status_code == 200:
-                data = response.json()
-                if data['totalSize'] > 0:
-                    return data['records'][0]
-            return None
+                lookup, thread_lookup = orjson.loads(response.content)['compositeResponse']
+                if lookup['httpStatusCode'] == 200 and thread_lookup['httpStatusCode'] == 200:
+                    records = lookup['body']['records']
+                    contact = records[0] if records else None
+                    contact_cache.set(chat_id, contact or False)
+                    if not contact:
+                        return None, None
+                    contact_etag_cache.set(chat_id, {'record': contact, 'etag': None})
+                    
+                    records = thread_lookup['body']['records']
+                    thread = records[0] if records else None
+                    thread_cache.set(chat_id, thread or False)
+                    return contact, thread
+            
+            logger.warning("⚠️ Composite user lookup failed (%s), retrying per call", response.status_code)
             
         except Exception as e:
-            logger.error(f"❌ Error getting thread status: {e}")
-            return None
+            logger.error("❌ Error fetching user context: %s", e)
+        
+        # The two lookups are independent; run them side by side
+        thread_future = io_executor.submit(self.get_thread_status, chat_id)
+        contact = self.check_existing_contact(chat_id)
+        thread = thread_future.result()
+        if not contact:
+            return None, None
+        return contact, thread
     
     def find_contact_by_phone(self, phone_number):
         """Find contact by phone number in Salesforce"""
+        cached = contact_phone_cache.get(phone_number)
+        if cached is not None:
+            return cached
+        
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            clean_phone = re.sub(r'[^\d]', '', phone_number)
+            clean_phone = phone_number.translate(NON_DIGIT_TABLE)
             
-            query = f"""
-            SELECT Id, FirstName, LastName, Salutation, Phone, MobilePhone, Email 
-            FROM Contact 
-            WHERE Phone LIKE '%{clean_phone}' 
-               OR MobilePhone LIKE '%{clean_phone}'
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['totalSize'] > 0:
-                    return data['records'][0]
-            return None
+            contact = self._query_first(contact_phone_query(clean_phone), headers)
+            if contact:
+                contact_phone_cache.set(phone_number, contact)
+            return contact
             
         except Exception as e:
-            logger.error(f"❌ Error finding contact by phone: {e}")
+            logger.error("❌ Error finding contact by phone: %s", e)
             return None
     
     def find_contact_by_email(self, email):
         """Find contact by email in Salesforce"""
+        email_key = email.strip().lower()
+        cached = contact_email_cache.get(email_key)
+        if cached is not None:
+            return cached
+        
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            query = f"SELECT Id, FirstName, LastName, Salutation, Phone, Email FROM Contact WHERE Email = '{email}' LIMIT 1"
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['totalSize'] > 0:
-                    return data['records'][0]
-            return None
+            contact = self._query_first(contact_email_query(email), headers)
+            if contact:
+                contact_email_cache.set(email_key, contact)
+            return contact
             
         except Exception as e:
-            logger.error(f"❌ Error finding contact by email: {e}")
+            logger.error("❌ Error finding contact by email: %s", e)
             return None
     
     def update_contact_chat_id(self, contact_id, chat_id):
         """Update contact with Telegram Chat ID"""
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return False
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
             url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Contact/{contact_id}"
             data = {
                 'Telegram_Chat_ID__c': str(chat_id)
             }
             
-            response = requests.patch(url, headers=headers, json=data, timeout=30)
+            response = self._sf_call('PATCH', url, headers, data=orjson.dumps(data))
             
             if response.status_code == 204:
-                logger.info(f"✅ Updated contact {contact_id} with chat ID {chat_id}")
+                logger.info("✅ Updated contact %s with chat ID %s", contact_id, chat_id)
+                contact_cache.delete(chat_id)
+                contact_etag_cache.delete(chat_id)
                 return True
             else:
-                logger.error(f"❌ Failed to update contact: {response.status_code} - {response.text}")
+                logger.error("❌ Failed to update contact: %s - %s", response.status_code, response.text)
                 return False
                 
         except Exception as e:
-            logger.error(f"❌ Error updating contact: {e}")
+            logger.error("❌ Error updating contact: %s", e)
             return False
     
+    def find_and_link_contact(self, query, chat_id):
+        """Look up a contact and set its Telegram Chat ID in one composite request.
+
+        Returns (contact, linked); contact is None when nothing matched. Falls
+        back to separate query and update calls if the composite call fails.
+        """
+        try:
+            headers = self._auth_headers()
+            if not headers:
+                return None, False
+            
+            data = {
+                'allOrNone': False,
+                'compositeRequest': [
+                    composite_query(query, 'contact'),
+                    {
+                        'method': 'PATCH',
+                        'url': f"{SF_API_PATH}/sobjects/Contact/@{{contact.records[0].Id}}",
+                        'referenceId': 'link',
+                        'body': {'Telegram_Chat_ID__c': str(chat_id)}
+                    }
+                ]
+            }
+            
+            response = self._sf_call('POST', self.composite_url, headers, data=orjson.dumps(data))
+            
+            if response.status_code == 200:
+                lookup, link = orjson.loads(response.content)['compositeResponse']
+                if lookup['httpStatusCode'] == 200:
+                    records = lookup['body']['records']
+                    if not records:
+                        return None, False
+                    contact = records[0]
+                    if link['httpStatusCode'] == 204:
+                        logger.info("✅ Updated contact %s with chat ID %s", contact['Id'], chat_id)
+                        # The lookup already returned the fields the menu needs
+                        contact_cache.set(chat_id, contact)
+                        contact_etag_cache.set(chat_id, {'record': contact, 'etag': None})
+                        return contact, True
+                    # Lookup worked but the update didn't; retry it on its own
+                    return contact, self.update_contact_chat_id(contact['Id'], chat_id)
+            
+            logger.warning("⚠️ Composite contact link failed (%s), retrying per call", response.status_code)
+            contact = self._query_first(query, headers)
+            if not contact:
+                return None, False
+            return contact, self.update_contact_chat_id(contact['Id'], chat_id)
+            
+        except Exception as e:
+            logger.error("❌ Error linking contact: %s", e)
+            return None, False
+    
     def create_new_contact(self, first_name, last_name, phone, gender, chat_id):
         """Create new contact in Salesforce"""
         try:
-            access_token = self.sf_auth.get_access_token()
-            if not access_token:
+            headers = self._auth_headers()
+            if not headers:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Contact/"
             data = {
                 'FirstName': first_name,
                 'LastName': last_name,
-                'Salutation': 'Mr.' if gender.lower() == 'male' else 'Ms.',
+                'Salutation': SALUTATIONS.get(gender.lower(), 'Ms.'),
                 'MobilePhone': phone,
                 'Phone': phone,
                 'Telegram_Chat_ID__c': str(chat_id)
             }
             
-            response = requests.post(url, headers=headers, json=data, timeout=30)
+            response = self._sf_call('POST', f"{self.contact_url}/", headers, data=orjson.dumps(data))
             
             if response.status_code == 201:
-                result = response.json()
-                logger.info(f"✅ Created new contact: {result['id']}")
+                result = orjson.loads(response.content)
+                logger.info("✅ Created new contact: %s", result['id'])
+                # We already know every field the menu reads; no need to query it back
+                contact = {
+                    'Id': result['id'],
+                    'FirstName': first_name,
+                    'LastName': last_name,
+                    'Salutation': data['Salutation']
+                }
+                contact_cache.set(chat_id, contact)
+                contact_etag_cache.set(chat_id, {'record': contact, 'etag': None})
                 return result['id']
             else:
-                logger.error(f"❌ Failed to create contact: {response.status_code} - {response.text}")
+                logger.error("❌ Failed to create contact: %s - %s", response.status_code, response.text)
                 return None
                 
         except Exception as e:
-            logger.error(f"❌ Error creating contact: {e}")
+            logger.error("❌ Error creating contact: %s", e)
             return None
 
 # Initialize bot manager
 bot_manager = TelegramBotManager()
 
+def token_refresh_loop(auth):
+    """Warm the Salesforce token at boot, then refresh it shortly before it expires"""
+    # Fetch the first token here rather than on the first user's webhook
+    try:
+        auth.get_access_token()
+    except Exception as e:
+        logger.error("❌ Initial token fetch failed: %s", e)
+    
+    while True:
+        # Wake when the shared copy (which expires 60s early) is down to
+        # MIN_SHARED_TTL; a token another worker already refreshed is adopted
+        time.sleep(max(60, auth.token_expiry - 60 - auth.MIN_SHARED_TTL - time.time()))
+        try:
+            auth.refresh_if_expiring()
+        except Exception as e:
+            logger.error("❌ Background token refresh failed: %s", e)
+
+threading.Thread(target=token_refresh_loop, args=(bot_manager.sf_auth,), daemon=True).start()
+
+# Reply texts, built once at import
+MENU_OPTIONS = (
+    'Please choose an option:\n'
+    '1️⃣ Track your Case\n'
+    '2️⃣ Contact Customer Support'
+)
+MAIN_MENU_MSG = '👋 Welcome back, {salutation} {first_name}!\n\n' + MENU_OPTIONS
+TRACK_CASE_MSG = '📋 Case tracking feature is coming soon!\n\n' + MENU_OPTIONS
+WELCOME_MSG = (
+    '👋 Welcome to Bank of Abyssinia!\n\n'
+    'Please share your phone number or email address to get started.'
+)
+GET_STARTED_MSG = (
+    '👋 Welcome! To get started, please share:\n\n'
+    '• Your phone number (0912121212)\n'
+    '• Or your email address'
+)
+GENDER_PROMPT = (
+    'Please select your gender:\n'
+    '• Male\n'
+    '• Female'
+)
+NEW_REGISTRATION_MSG = '📝 New registration detected.\n\n' + GENDER_PROMPT
+NAME_PROMPT = (
+    'Please enter your First Name and Last Name (separated by space):\n'
+    'Example: John Smith'
+)
+FULL_NAME_PROMPT = (
+    'Please enter both First Name and Last Name (separated by space):\n'
+    'Example: John Smith'
+)
+
 # Utility functions
+# Patterns compiled once instead of going through re's cache on every message
+PHONE_PATTERN = re.compile(r'^(\+?251|0)?[97]\d{8}$')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# str.translate table deleting ASCII non-digits; cheaper than a regex sub for
+# short strings. Phone numbers are checked against PHONE_PATTERN first, so
+# the only non-ASCII characters left are digits, which \D would keep too.
+NON_DIGIT_TABLE = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
 def is_phone_number(text):
     if not text:
         return False
-    phone_pattern = r'^(\+?251|0)?[97]\d{8}$'
-    return re.match(phone_pattern, text.strip()) is not None
+    return PHONE_PATTERN.match(text.strip()) is not None
 
 def is_email(text):
     if not text:
         return False
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(email_pattern, text.strip()) is not None
+    return EMAIL_PATTERN.match(text.strip()) is not None
 
 def clean_phone_number(phone):
     """Clean phone number for Salesforce"""
     if not phone:
         return ""
-    cleaned = re.sub(r'[^\d]', '', phone)
+    cleaned = phone.translate(NON_DIGIT_TABLE)
     if cleaned.startswith('251'):
         cleaned = cleaned[3:]
     if not cleaned.startswith('0'):
         cleaned = '0' + cleaned
     return cleaned
 
-def handle_registered_user(chat_id, message_text, user_data):
-    """Handle messages from registered users"""
+def handle_registered_user(chat_id, message_text, user_data, thread, state):
+    """Handle messages from registered users.
+    
+    thread is the chat's latest conversation thread, or None; state is the
+    chat's entry in user_states.
+    """
     chat_id_str = str(chat_id)
     message_lower = message_text.strip().lower()
     
-    logger.info(f"👤 Registered user {chat_id} sent: {message_text}")
+    logger.info("👤 Registered user %s sent: %s", chat_id, message_text)
+    
+    state_type = state.get('type') if state else None
     
     # Check if user is in registration flow
-    if chat_id_str in user_states and user_states[chat_id_str].get('type') == 'registration':
-        handle_registration_flow(chat_id, message_text, user_data)
+    if state_type == 'registration':
+        reply = handle_registration_flow(chat_id, message_text, user_data, state)
+        if reply:
+            bot_manager.send_message(chat_id, reply)
         return
     
     # Check if user is submitting support request description
-    if chat_id_str in user_states and user_states[chat_id_str].get('type') == 'support_description':
+    if state_type == 'support_description':
         # This is their support request description
         send_to_salesforce(chat_id, message_text, user_data)
-        user_states.pop(chat_id_str, None)
+        user_states.delete(chat_id_str)
         
         bot_manager.send_message(chat_id,
             '✅ Your request has been received!\n\n'
@@ -409,13 +981,11 @@ def handle_registered_user(chat_id, message_text, user_data):
         return
     
     # Check thread status
-    thread = bot_manager.get_thread_status(chat_id)
-    
     if thread:
         thread_status = thread.get('Status__c')
         is_assigned = thread.get('Assigned__c', False)
         
-        logger.info(f"🧵 Thread status: {thread_status}, Assigned: {is_assigned}")
+        logger.info("🧵 Thread status: %s, Assigned: %s", thread_status, is_assigned)
         
         if thread_status == 'Active' and is_assigned:
             # Active conversation with agent
@@ -435,19 +1005,14 @@ def handle_registered_user(chat_id, message_text, user_data):
             return
     
     # Handle menu selection for closed/new threads
-    if message_lower == '1' or 'track' in message_lower:
-        bot_manager.send_message(chat_id,
-            '📋 Case tracking feature is coming soon!\n\n'
-            'Please choose an option:\n'
-            '1️⃣ Track your Case\n'
-            '2️⃣ Contact Customer Support'
-        )
-    elif message_lower == '2' or 'support' in message_lower or 'contact' in message_lower:
+    if message_lower == '1' or message_lower.startswith('track'):
+        bot_manager.send_message(chat_id, TRACK_CASE_MSG)
+    elif message_lower == '2' or message_lower.startswith(('support', 'contact')):
         # Start support request
-        user_states[chat_id_str] = {
+        user_states.set(chat_id_str, {
             'type': 'support_description',
             'user_data': user_data
-        }
+        })
         
         # Send to Salesforce to update thread status
         send_to_salesforce(chat_id, "Customer selected: Contact Customer Support", user_data)
@@ -464,91 +1029,185 @@ def show_main_menu(chat_id, user_data):
     """Show main menu to registered users"""
     contact = bot_manager.check_existing_contact(chat_id)
     if contact:
-        salutation = contact.get('Salutation', '')
-        first_name = contact.get('FirstName', 'there')
+        bot_manager.send_message(chat_id, MAIN_MENU_MSG.format(
+            salutation=contact.get('Salutation', ''),
+            first_name=contact.get('FirstName', 'there')
+        ))
+    else:
+        bot_manager.send_message(chat_id, WELCOME_MSG)
+
+def _bootstrap(chat_id, message_text, user_data, state):
+    """First message from an unregistered user: link by phone/email or prompt"""
+    text = message_text.strip()
+    if is_phone_number(text):
+        clean_phone = clean_phone_number(text)
+        logger.info("📞 Checking phone: %s", clean_phone)
         
-        bot_manager.send_message(chat_id,
-            f'👋 Welcome back, {salutation} {first_name}!\n\n'
-            'Please choose an option:\n'
-            '1️⃣ Track your Case\n'
-            '2️⃣ Contact Customer Support'
+        # Find the contact and link this chat to it in one round trip
+        contact, success = bot_manager.find_and_link_contact(
+            contact_phone_query(clean_phone), chat_id
         )
+        
+        if contact:
+            _finish_link(chat_id, user_data, success)
+        else:
+            # Start new registration
+            user_states.set(str(chat_id), {
+                'type': 'registration',
+                'phone': clean_phone,
+                'step': 'gender',
+                'user_data': user_data
+            })
+            bot_manager.send_message(chat_id, NEW_REGISTRATION_MSG)
+    
+    elif is_email(text):
+        contact, success = bot_manager.find_and_link_contact(
+            contact_email_query(text), chat_id
+        )
+        
+        if contact:
+            _finish_link(chat_id, user_data, success)
+        else:
+            bot_manager.send_message(chat_id,
+                '❌ No account found with this email.\n\n'
+                'Please share your phone number to create a new account.'
+            )
+    
+    else:
+        # Single reply: returned for the caller to send
+        return GET_STARTED_MSG
+
+def _finish_link(chat_id, user_data, success):
+    """Reply after linking this chat to an existing contact"""
+    if success:
+        show_main_menu(chat_id, user_data)
     else:
         bot_manager.send_message(chat_id,
-            '👋 Welcome to Bank of Abyssinia!\n\n'
-            'Please share your phone number or email address to get started.'
+            '❌ Failed to connect your account. Please try again.'
         )
 
-def handle_registration_flow(chat_id, message_text, user_data):
-    """Handle user registration flow"""
+def _step_gender(chat_id, message_text, user_data, state):
+    """Registration step: collect gender"""
+    gender = message_text.lower()
+    if gender in ('male', 'female'):
+        state['gender'] = gender
+        state['step'] = 'name'
+        user_states.set(str(chat_id), state)
+        
+        bot_manager.send_message(chat_id, NAME_PROMPT)
+    else:
+        bot_manager.send_message(chat_id, GENDER_PROMPT)
+
+def _step_name(chat_id, message_text, user_data, state):
+    """Registration step: collect name and create the contact"""
     chat_id_str = str(chat_id)
-    state = user_states[chat_id_str]
+    name_parts = message_text.split(' ', 1)
+    if len(name_parts) < 2:
+        bot_manager.send_message(chat_id, FULL_NAME_PROMPT)
+        return
     
-    if state['step'] == 'gender':
-        if message_text.lower() in ['male', 'female']:
-            state['gender'] = message_text.lower()
-            state['step'] = 'name'
-            user_states[chat_id_str] = state
-            
-            bot_manager.send_message(chat_id,
-                'Please enter your First Name and Last Name (separated by space):\n'
-                'Example: John Smith'
-            )
-        else:
-            bot_manager.send_message(chat_id,
-                'Please select your gender:\n'
-                '• Male\n'
-                '• Female'
-            )
+    first_name, last_name = name_parts
     
-    elif state['step'] == 'name':
-        name_parts = message_text.split(' ', 1)
-        if len(name_parts) >= 2:
-            first_name = name_parts[0]
-            last_name = name_parts[1]
-            
-            # Create new contact
-            contact_id = bot_manager.create_new_contact(
-                first_name=first_name,
-                last_name=last_name,
-                phone=state['phone'],
-                gender=state['gender'],
-                chat_id=chat_id
-            )
-            
-            if contact_id:
-                # Clear user state
-                user_states.pop(chat_id_str, None)
-                
-                # Show main menu
-                show_main_menu(chat_id, user_data)
-            else:
-                bot_manager.send_message(chat_id,
-                    '❌ Sorry, we encountered an error creating your account. Please try again.'
-                )
-        else:
-            bot_manager.send_message(chat_id,
-                'Please enter both First Name and Last Name (separated by space):\n'
-                'Example: John Smith'
-            )
+    # Another request for this chat is already creating the contact
+    if not contact_create_locks.claim(chat_id_str):
+        bot_manager.send_message(chat_id,
+            '⏳ Your registration is already in progress. Please wait a moment.'
+        )
+        return
+    
+    # Create new contact
+    try:
+        contact_id = bot_manager.create_new_contact(
+            first_name=first_name,
+            last_name=last_name,
+            phone=state['phone'],
+            gender=state['gender'],
+            chat_id=chat_id
+        )
+    finally:
+        contact_create_locks.delete(chat_id_str)
+    
+    if contact_id:
+        # Clear user state
+        user_states.delete(chat_id_str)
+        
+        # Show main menu
+        show_main_menu(chat_id, user_data)
+    else:
+        bot_manager.send_message(chat_id,
+            '❌ Sorry, we encountered an error creating your account. Please try again.'
+        )
+
+# Registration state machine: current step -> handler. No state means the
+# user has not started registering yet.
+HANDLERS = {
+    None: _bootstrap,
+    'gender': _step_gender,
+    'name': _step_name,
+}
+
+def handle_registration_flow(chat_id, message_text, user_data, state):
+    """Dispatch a message to the handler for the user's registration step.
+    
+    Returns reply text for the caller to send, or None if the handler
+    already replied.
+    """
+    step = state.get('step') if state else None
+    return HANDLERS.get(step, _bootstrap)(chat_id, message_text, user_data, state)
+
+# Salesforce forwards run off the webhook thread. Each chat always maps to the
+# same single-threaded executor, so its messages still arrive in order.
+FORWARD_SHARDS = 8
+forward_executors = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'sf-forward-{i}')
+    for i in range(FORWARD_SHARDS)
+]
+
+def shutdown_forward_executors():
+    for executor in forward_executors:
+        executor.shutdown(wait=True)
+
+atexit.register(shutdown_forward_executors)
+
+# Runs independent Redis/Salesforce calls side by side within one update.
+# Size it above UPDATE_SHARDS so jobs don't queue. Registered before the
+# update executors, so it is still open while they drain at exit.
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+atexit.register(io_executor.shutdown)
+
+# Incoming messages are processed after the webhook returns, sharded by chat
+# like the forwards so one user's messages are still handled in order.
+# Registered after the forward executors, so it drains first at exit.
+update_executors = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'update-{i}')
+    for i in range(UPDATE_SHARDS)
+]
+
+def shutdown_update_executors():
+    for executor in update_executors:
+        executor.shutdown(wait=True)
+
+atexit.register(shutdown_update_executors)
 
 def send_to_salesforce(chat_id, message, user_data):
-    """Send message to Salesforce for processing"""
+    """Queue a message for Salesforce; returns False only if it couldn't be queued"""
     try:
+        timestamp = str(int(time.time()))
         payload = {
             'chatId': str(chat_id),
             'userId': str(user_data.get('id', '')),
             'message': message,
-            'messageId': str(int(time.time())),
-            'timestamp': str(int(time.time())),
+            'messageId': timestamp,
+            'timestamp': timestamp,
             'firstName': user_data.get('first_name', ''),
             'lastName': user_data.get('last_name', '')
         }
         
-        success = bot_manager.forward_to_salesforce(payload)
-        return success
+        executor = forward_executors[int(chat_id) % FORWARD_SHARDS]
+        executor.submit(bot_manager.forward_to_salesforce, payload)
+        return True
     except Exception as e:
-        logger.error(f"❌ Error sending to Salesforce: {e}")
+        logger.error("❌ Error sending to Salesforce: %s", e)
         return False
 
 # Flask routes
@@ -564,6 +1223,8 @@ def send_to_user():
         chat_id = data['chat_id']
         message = data['message']
         
+        # An agent replying means the thread status has likely changed
+        thread_cache.delete(chat_id)
         success = bot_manager.send_message(chat_id, message)
         
         if success:
@@ -576,111 +1237,83 @@ def send_to_user():
             return jsonify({'error': 'Failed to send message to Telegram'}), 500
             
     except Exception as e:
-        logger.error(f"❌ Send error: {e}")
+        logger.error("❌ Send error: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def process_message(chat_id, message_text, user_data):
+    """Handle one incoming message after the webhook has been acknowledged"""
+    try:
+        # Both kinds of user need their state; with Redis, read it while
+        # Salesforce answers
+        state_future = None
+        if user_states.client is not None:
+            state_future = io_executor.submit(user_states.get, str(chat_id))
+        
+        # Check if user is already registered, fetching their thread
+        # in the same round trip
+        existing_contact, thread = bot_manager.fetch_user_context(chat_id)
+        if state_future is not None:
+            state = state_future.result()
+        else:
+            state = user_states.get(str(chat_id))
+        
+        if existing_contact:
+            # Registered user
+            handle_registered_user(chat_id, message_text, user_data, thread, state)
+            return
+        
+        # Unregistered user - continue or start registration
+        reply = handle_registration_flow(chat_id, message_text, user_data, state)
+        if reply:
+            bot_manager.send_message(chat_id, reply)
+    except Exception as e:
+        logger.error("❌ Error processing message from %s: %s", chat_id, e)
+
+def webhook_reply(chat_id, text):
+    """Answer an update with a sendMessage in the webhook response body.
+    
+    Telegram runs the method itself, which saves a Bot API round trip. Only
+    use it for the last reply to an update: there is no delivery result.
+    """
+    return jsonify({
+        'method': 'sendMessage',
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': 'HTML'
+    })
+
 @app.route('/webhook', methods=['POST'])
 def telegram_webhook():
     """Receive Telegram webhook"""
+    update_id = None
     try:
         if request.is_json:
             update_data = request.get_json()
             
-            if 'message' in update_data:
-                message = update_data['message']
+            # Ignore updates Telegram has already delivered to us
+            update_id = update_data.get('update_id')
+            if update_id is not None and not seen_updates.claim(update_id):
+                logger.info("🔁 Duplicate update %s ignored", update_id)
+                return jsonify({'status': 'duplicate'})
+            
+            # Only text messages are handled; skip edits, callbacks, stickers,
+            # photos etc. before any Salesforce I/O
+            message = update_data.get('message')
+            if message and 'text' in message:
                 chat_id = message['chat']['id']
-                message_text = message.get('text', '')
+                message_text = message['text']
                 user_data = message.get('from', {})
                 
-                logger.info(f"📥 Message from {chat_id}: {message_text}")
+                logger.info("📥 Message from %s: %s", chat_id, message_text)
                 
                 # Handle /start command
                 if message_text == '/start':
-                    bot_manager.send_message(chat_id,
-                        '👋 Welcome to Bank of Abyssinia!\n\n'
-                        'Please share your phone number or email address to get started.'
-                    )
-                    return jsonify({'status': 'ok'})
-                
-                # Check if user is already registered
-                existing_contact = bot_manager.check_existing_contact(chat_id)
-                
-                if existing_contact:
-                    # Registered user
-                    handle_registered_user(chat_id, message_text, user_data)
-                    return jsonify({'status': 'ok'})
-                
-                # Unregistered user - handle registration
-                chat_id_str = str(chat_id)
+                    return webhook_reply(chat_id, WELCOME_MSG)
                 
-                # Check if we have registration state for this user
-                if chat_id_str not in user_states:
-                    # Start new registration
-                    if is_phone_number(message_text):
-                        clean_phone = clean_phone_number(message_text)
-                        logger.info(f"📞 Checking phone: {clean_phone}")
-                        
-                        bot_manager.send_message(chat_id,
-                            '📞 Checking your phone number...'
-                        )
-                        
-                        # Check if contact exists
-                        contact = bot_manager.find_contact_by_phone(clean_phone)
-                        
-                        if contact:
-                            # Update existing contact
-                            success = bot_manager.update_contact_chat_id(contact['Id'], chat_id)
-                            if success:
-                                show_main_menu(chat_id, user_data)
-                            else:
-                                bot_manager.send_message(chat_id,
-                                    '❌ Failed to connect your account. Please try again.'
-                                )
-                        else:
-                            # Start new registration
-                            user_states[chat_id_str] = {
-                                'type': 'registration',
-                                'phone': clean_phone,
-                                'step': 'gender',
-                                'user_data': user_data
-                            }
-                            bot_manager.send_message(chat_id,
-                                '📝 New registration detected.\n\n'
-                                'Please select your gender:\n'
-                                '• Male\n'
-                                '• Female'
-                            )
-                    
-                    elif is_email(message_text):
-                        bot_manager.send_message(chat_id,
-                            '📧 Checking your email address...'
-                        )
-                        
-                        contact = bot_manager.find_contact_by_email(message_text)
-                        
-                        if contact:
-                            success = bot_manager.update_contact_chat_id(contact['Id'], chat_id)
-                            if success:
-                                show_main_menu(chat_id, user_data)
-                            else:
-                                bot_manager.send_message(chat_id,
-                                    '❌ Failed to connect your account. Please try again.'
-                                )
-                        else:
-                            bot_manager.send_message(chat_id,
-                                '❌ No account found with this email.\n\n'
-                                'Please share your phone number to create a new account.'
-                            )
-                    
-                    else:
-                        bot_manager.send_message(chat_id,
-                            '👋 Welcome! To get started, please share:\n\n'
-                            '• Your phone number (0912121212)\n'
-                            '• Or your email address'
-                        )
-                else:
-                    # Continue registration based on current step
-                    handle_registration_flow(chat_id, message_text, user_data)
+                # Everything else waits on Salesforce; acknowledge Telegram now
+                # so a slow lookup can't trigger a redelivery
+                executor = update_executors[int(chat_id) % UPDATE_SHARDS]
+                executor.submit(process_message, chat_id, message_text, user_data)
             
             return jsonify({'status': 'ok'})
         else:
@@ -688,7 +1321,10 @@ def telegram_webhook():
             return jsonify({'error': 'Invalid data format'}), 400
             
     except Exception as e:
-        logger.error(f"❌ Webhook error: {e}")
+        logger.error("❌ Webhook error: %s", e)
+        # Let Telegram's retry of this update through
+        if update_id is not None:
+            seen_updates.delete(update_id)
         return jsonify({'error': str(e)}), 500
 
 # Set webhook endpoint
@@ -702,10 +1338,10 @@ def set_webhook():
         webhook_url = f"https://{request.host}/webhook"
         set_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook?url={webhook_url}"
         
-        logger.info(f"🔗 Setting webhook to: {webhook_url}")
+        logger.info("🔗 Setting webhook to: %s", webhook_url)
         
-        response = requests.get(set_url)
-        result = response.json()
+        response = tg_session.get(set_url, timeout=30)
+        result = orjson.loads(response.content)
         
         if result.get('ok'):
             return jsonify({
@@ -721,7 +1357,7 @@ def set_webhook():
             }), 500
             
     except Exception as e:
-        logger.error(f"❌ Set webhook error: {e}")
+        logger.error("❌ Set webhook error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # Test Salesforce connection
@@ -785,9 +1421,13 @@ if __name__ == '__main__':
     logger.info("=" * 50)
     
     if missing_vars:
-        logger.error(f"❌ Missing environment variables: {', '.join(missing_vars)}")
+        logger.error("❌ Missing environment variables: %s", ', '.join(missing_vars))
     else:
         logger.info("✅ All environment variables are set")
     
-    logger.info(f"🌐 Starting server on port {PORT}")
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    logger.info("🌐 Starting server on port %s", PORT)
+    if USE_GEVENT:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', PORT), app).serve_forever()
+    else:
+        app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
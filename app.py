@@ -1,14 +1,32 @@
 import os
+
+# Cooperative I/O: with gevent, blocking Salesforce/Telegram calls yield to
+# other requests. This has to patch before requests/flask are imported.
+# (Under gunicorn, `-k gevent` patches by itself.)
+USE_GEVENT = os.getenv('USE_GEVENT', 'false').lower() == 'true'
+if USE_GEVENT:
+    from gevent import monkey
+    monkey.patch_all()
+
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import re
-import json
+import orjson
+import jwt
+import redis
 import uuid
-from datetime import datetime
+import itertools
+import threading
+import atexit
+from datetime import datetime, timezone
 from collections import OrderedDict
-from urllib.parse import urlparse
-from flask import Flask, request, jsonify, g
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse, quote_plus
+from flask import Flask, request, jsonify, g, has_app_context
+from flask.json.provider import JSONProvider
 
 # ============================================
 
@@ -16,8 +34,14 @@ from flask import Flask, request, jsonify, g
 MAX_BULK_RECIPIENTS = int(os.getenv('MAX_BULK_RECIPIENTS', '500'))
 BULK_SEND_DELAY = float(os.getenv('BULK_SEND_DELAY', '0.1'))  # 100ms between messages
 TELEGRAM_RATE_LIMIT = int(os.getenv('TELEGRAM_RATE_LIMIT', '25'))  # Messages per second
+TELEGRAM_CHAT_RATE_LIMIT = float(os.getenv('TELEGRAM_CHAT_RATE_LIMIT', '1'))  # Messages per second per chat
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
 ALLOWED_ATTACHMENT_DOMAINS = os.getenv('ALLOWED_ATTACHMENT_DOMAINS', '').split(',')
 MAX_ATTACHMENT_SIZE_MB = int(os.getenv('MAX_ATTACHMENT_SIZE_MB', '5'))
+# Salesforce queue that owns waiting Telegram chat sessions
+QUEUE_OWNER_NAME = 'New Telegram Messages'
+# Backoff (seconds) while waiting for Salesforce to create a new chat session
+SESSION_POLL_DELAYS = (0.1, 0.2, 0.4, 0.8, 1.5)
 # ENHANCED CONFIGURATION WITH SECURITY SETTINGS
 # ============================================
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -26,13 +50,75 @@ SF_INSTANCE_URL = os.getenv('SF_INSTANCE_URL')
 SF_CLIENT_ID = os.getenv('SF_CLIENT_ID')
 SF_CLIENT_SECRET = os.getenv('SF_CLIENT_SECRET')
 
+# Refresh the Salesforce token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+# Optional JWT Bearer flow (used instead of client_credentials when both are set)
+SF_USERNAME = os.getenv('SF_USERNAME')
+SF_PRIVATE_KEY = os.getenv('SF_PRIVATE_KEY', '').replace('\\n', '\n')
+SF_LOGIN_URL = os.getenv('SF_LOGIN_URL', 'https://login.salesforce.com')
+USE_JWT_BEARER = bool(SF_USERNAME and SF_PRIVATE_KEY)
+
 # Security configurations
 RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '30'))
 MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '4000'))
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+# How long a message waits for the next one to the same chat before it is sent alone
+SEND_COALESCE_WINDOW = float(os.getenv('SEND_COALESCE_WINDOW', '0.2'))  # seconds
 REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '30'))
 ENABLE_RATE_LIMITING = os.getenv('ENABLE_RATE_LIMITING', 'true').lower() == 'true'
 ENABLE_INPUT_SANITIZATION = os.getenv('ENABLE_INPUT_SANITIZATION', 'true').lower() == 'true'
 PORT = int(os.getenv('PORT', '10000'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+SESSION_STATE_MAX_ENTRIES = int(os.getenv('SESSION_STATE_MAX_ENTRIES', '100000'))
+SESSION_STATE_TTL = int(os.getenv('SESSION_STATE_TTL', '86400'))  # seconds of inactivity
+
+# Optional Redis for session state shared across gunicorn workers/instances
+REDIS_URL = os.getenv('REDIS_URL')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '64'))
+
+# Caching configurations
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CHANNEL_USER_CACHE_TTL = int(os.getenv('CHANNEL_USER_CACHE_TTL', '600'))  # seconds
+CONTACT_PHONE_CACHE_TTL = int(os.getenv('CONTACT_PHONE_CACHE_TTL', '300'))  # seconds
+USER_CONTEXT_CACHE_TTL = int(os.getenv('USER_CONTEXT_CACHE_TTL', '60'))  # seconds
+ACTIVE_SESSIONS_CACHE_TTL = int(os.getenv('ACTIVE_SESSIONS_CACHE_TTL', '5'))  # seconds
+HEALTH_CHECK_CACHE_TTL = int(os.getenv('HEALTH_CHECK_CACHE_TTL', '10'))  # seconds
+QUEUE_POSITION_CACHE_TTL = int(os.getenv('QUEUE_POSITION_CACHE_TTL', '3'))  # seconds
+QUEUE_SNAPSHOT_TTL = int(os.getenv('QUEUE_SNAPSHOT_TTL', '5'))  # seconds
+QUEUE_SNAPSHOT_LIMIT = int(os.getenv('QUEUE_SNAPSHOT_LIMIT', '500'))
+
+# Shared HTTP connection pool
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '32'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '64'))
+
+# Background update processing - updates for one chat always land on the
+# same single-threaded shard so they are handled in order
+UPDATE_WORKER_SHARDS = int(os.getenv('UPDATE_WORKER_SHARDS', '16'))
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+CHAT_ACTION_WORKERS = int(os.getenv('CHAT_ACTION_WORKERS', '2'))
+# Updates waiting on the shards before the webhook asks Telegram to retry later
+UPDATE_BACKLOG_MAX = int(os.getenv('UPDATE_BACKLOG_MAX', '1000'))
+# How long a handled update_id is remembered so Telegram redeliveries are dropped
+SEEN_UPDATE_TTL = int(os.getenv('SEEN_UPDATE_TTL', '3600'))
+
+# Dedicated Telegram pool - one warm connection per update shard and typing
+# worker by default. Blocking makes bursts beyond that wait for a free
+# connection instead of opening extra ones that are thrown away afterwards.
+TELEGRAM_POOL_MAXSIZE = int(os.getenv('TELEGRAM_POOL_MAXSIZE', str(UPDATE_WORKER_SHARDS + CHAT_ACTION_WORKERS)))
+TELEGRAM_POOL_BLOCK = os.getenv('TELEGRAM_POOL_BLOCK', 'true').lower() == 'true'
+
+# Outbound timeouts as (connect, read) seconds
+SF_TIMEOUT = (
+    float(os.getenv('SF_CONNECT_TIMEOUT', '5')),
+    float(os.getenv('SF_READ_TIMEOUT', '10'))
+)
+TYPING_ACTION_TIMEOUT = 2
+
+# Salesforce circuit breaker
+SF_BREAKER_FAIL_MAX = int(os.getenv('SF_BREAKER_FAIL_MAX', '5'))
+SF_BREAKER_WINDOW = int(os.getenv('SF_BREAKER_WINDOW', '30'))  # seconds
+SF_BREAKER_RESET_TIMEOUT = int(os.getenv('SF_BREAKER_RESET_TIMEOUT', '30'))  # seconds
 
 # Validate required environment variables
 missing_vars = []
@@ -41,18 +127,96 @@ for var_name, var_value in [
     ('SALESFORCE_WEBHOOK_URL', SALESFORCE_WEBHOOK_URL),
     ('SF_INSTANCE_URL', SF_INSTANCE_URL),
     ('SF_CLIENT_ID', SF_CLIENT_ID),
-    ('SF_CLIENT_SECRET', SF_CLIENT_SECRET)
+    ('SF_CLIENT_SECRET', SF_CLIENT_SECRET or USE_JWT_BEARER)
 ]:
     if not var_value:
         missing_vars.append(var_name)
 
+if missing_vars:
+    raise RuntimeError(f"Missing environment variables: {', '.join(missing_vars)}")
+
+# Precomputed API endpoints
+SF_INSTANCE_URL = SF_INSTANCE_URL.rstrip('/')
+SF_API_PATH = '/services/data/v58.0'
+SF_API_BASE = f"{SF_INSTANCE_URL}{SF_API_PATH}"
+SF_TOKEN_URL = f"{SF_INSTANCE_URL}/services/oauth2/token"
+SF_QUERY_URL = f"{SF_API_BASE}/query"
+SF_COMPOSITE_URL = f"{SF_API_BASE}/composite"
+SF_SOBJECTS_URL = f"{SF_API_BASE}/sobjects"
+SF_CHANNEL_USER_URL = f"{SF_SOBJECTS_URL}/Channel_User__c"
+SF_CONTACT_URL = f"{SF_SOBJECTS_URL}/Contact"
+TELEGRAM_API_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
+TELEGRAM_SEND_URL = f"{TELEGRAM_API_BASE}/sendMessage"
+TELEGRAM_SEND_PHOTO_URL = f"{TELEGRAM_API_BASE}/sendPhoto"
+TELEGRAM_CHAT_ACTION_URL = f"{TELEGRAM_API_BASE}/sendChatAction"
+TELEGRAM_ANSWER_CALLBACK_URL = f"{TELEGRAM_API_BASE}/answerCallbackQuery"
+TELEGRAM_EDIT_MARKUP_URL = f"{TELEGRAM_API_BASE}/editMessageReplyMarkup"
+
+# SOQL templates, kept on one line so the query string is short and
+# identical apart from the literal; fill them with soql_literal() values.
+# Select only the fields the handlers read - widen these if a caller needs more.
+CHANNEL_USER_FIELDS = "Id, Name, Contact__c, Contact__r.FirstName"
+CHANNEL_USER_QUERY = (
+    f"SELECT {CHANNEL_USER_FIELDS} FROM Channel_User__c "
+    "WHERE Channel_Type__c = 'Telegram' AND Telegram_Chat_ID__c = {chat_id} LIMIT 1"
+)
+CHANNEL_USER_CONTEXT_QUERY = (
+    f"SELECT {CHANNEL_USER_FIELDS}, "
+    "(SELECT Id, Status__c FROM Support_Conversations__r "
+    "WHERE Status__c = 'Active' LIMIT 1) "
+    "FROM Channel_User__c "
+    "WHERE Channel_Type__c = 'Telegram' AND Telegram_Chat_ID__c = {chat_id} LIMIT 1"
+)
+CONTACT_BY_PHONE_QUERY = (
+    "SELECT Id, FirstName FROM Contact "
+    "WHERE Phone LIKE {pattern} OR MobilePhone LIKE {pattern} LIMIT 1"
+)
+# Queue lookups for QUEUE_OWNER_NAME; the snapshot query never changes
+WAITING_SESSIONS_QUERY = (
+    "SELECT Id, Support_Conversation__c FROM Chat_Session__c "
+    f"WHERE Owner.Name = '{QUEUE_OWNER_NAME}' AND Status__c = 'Waiting' "
+    f"ORDER BY CreatedDate ASC LIMIT {QUEUE_SNAPSHOT_LIMIT}"
+)
+LATEST_WAITING_SESSION_QUERY = (
+    "SELECT Id, CreatedDate FROM Chat_Session__c "
+    "WHERE Support_Conversation__c = '{conversation_id}' "
+    f"AND Owner.Name = '{QUEUE_OWNER_NAME}' AND Status__c = 'Waiting' "
+    "ORDER BY CreatedDate DESC LIMIT 1"
+)
+QUEUE_AHEAD_COUNT_QUERY = (
+    "SELECT COUNT() FROM Chat_Session__c "
+    f"WHERE Owner.Name = '{QUEUE_OWNER_NAME}' AND Status__c = 'Waiting' "
+    "AND CreatedDate < {created_before}"
+)
+ACTIVE_SESSIONS_QUERY = (
+    "SELECT Id, Status__c FROM Chat_Session__c "
+    "WHERE Support_Conversation__c = '{conversation_ref}' AND Status__c IN ('Active', 'Waiting') "
+    "ORDER BY Created_Date__c DESC LIMIT 1"
+)
+SESSION_DETAILS_QUERY = (
+    "SELECT Id, Name, Status__c, OwnerId, Owner.Name, "
+    "Assigned_Agent__c, Assigned_Agent__r.Name, "
+    "Created_Date__c, Last_Message_Time__c, Support_Conversation__c "
+    "FROM Chat_Session__c WHERE Id = '{session_id}'"
+)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for request parsing and jsonify"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # ============================================
 # ENHANCED LOGGING WITH SECURITY CONTEXT
 # ============================================
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - [IP:%(client_ip)s] - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -60,11 +224,19 @@ logger = logging.getLogger(__name__)
 # Add filter to inject request context
 class SecurityContextFilter(logging.Filter):
     def filter(self, record):
-        record.request_id = getattr(g, 'request_id', 'no-id')
-        record.client_ip = getattr(g, 'client_ip', 'no-ip')
+        # Logging also happens outside requests (startup, background work)
+        if has_app_context():
+            record.request_id = getattr(g, 'request_id', 'no-id')
+            record.client_ip = getattr(g, 'client_ip', 'no-ip')
+        else:
+            record.request_id = 'no-id'
+            record.client_ip = 'no-ip'
         return True
 
-logger.addFilter(SecurityContextFilter())
+# On the root handlers rather than our logger, so records from other
+# libraries (urllib3 retry warnings, werkzeug) get the fields too
+for handler in logging.getLogger().handlers:
+    handler.addFilter(SecurityContextFilter())
 
 # ============================================
 # RATE LIMITING IMPLEMENTATION
@@ -77,6 +249,7 @@ class RateLimiter:
         self.requests = OrderedDict()  # {ip: [timestamps]}
         self.cleanup_interval = 60  # Cleanup every 60 seconds
         self.last_cleanup = time.time()
+        self.lock = threading.Lock()
     
     def _cleanup_old_requests(self):
         """Remove requests older than 1 minute"""
@@ -99,31 +272,320 @@ class RateLimiter:
         
         current_time = time.time()
         
-        # Cleanup old requests if needed
-        if current_time - self.last_cleanup > self.cleanup_interval:
-            self._cleanup_old_requests()
-        
-        # Get or create IP entry
-        if ip not in self.requests:
-            self.requests[ip] = []
-        
-        # Remove timestamps older than 1 minute
-        self.requests[ip] = [t for t in self.requests[ip] if t > current_time - 60]
-        
-        # Check if rate limited
-        if len(self.requests[ip]) >= self.requests_per_minute:
-            return True
-        
-        # Add current request
-        self.requests[ip].append(current_time)
-        return False
+        with self.lock:
+            # Cleanup old requests if needed
+            if current_time - self.last_cleanup > self.cleanup_interval:
+                self._cleanup_old_requests()
+            
+            # Get or create IP entry
+            if ip not in self.requests:
+                self.requests[ip] = []
+            
+            # Remove timestamps older than 1 minute
+            self.requests[ip] = [t for t in self.requests[ip] if t > current_time - 60]
+            
+            # Check if rate limited
+            if len(self.requests[ip]) >= self.requests_per_minute:
+                return True
+            
+            # Add current request
+            self.requests[ip].append(current_time)
+            return False
 
 # Initialize rate limiter
 rate_limiter = RateLimiter(requests_per_minute=RATE_LIMIT_PER_MINUTE)
 
+# ============================================
+# SHARED HTTP SESSION
+# ============================================
+# Keep-alive connection pools so calls reuse TCP/TLS connections. Telegram
+# gets its own adapter sized to the update shards, so concurrent sends from
+# different shards never wait on (or evict) Salesforce connections. The
+# adapters only retry idempotent methods; POSTs keep their own retry loops.
+http_retry = Retry(
+    total=3,
+    backoff_factor=0.2,
+    status_forcelist=[429, 500, 502, 503, 504],
+    raise_on_status=False
+)
+
+http_session = requests.Session()
+http_session.headers['User-Agent'] = 'Telegram-Support-Bot/1.0'
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=HTTP_POOL_CONNECTIONS,
+    pool_maxsize=HTTP_POOL_MAXSIZE,
+    max_retries=http_retry
+))
+http_session.mount('https://api.telegram.org/', HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=TELEGRAM_POOL_MAXSIZE,
+    pool_block=TELEGRAM_POOL_BLOCK,
+    max_retries=http_retry
+))
+# atexit runs handlers in reverse, so this closes after the update workers drain
+atexit.register(http_session.close)
+
+# ============================================
+# SHARED REDIS CLIENT
+# ============================================
+# Only created when REDIS_URL is set; connections are opened on first use
+if REDIS_URL:
+    redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=2
+    ))
+else:
+    redis_client = None
+
+# ============================================
+# IN-MEMORY TTL CACHE
+# ============================================
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry expiry and LRU size cap"""
+    
+    def __init__(self, maxsize=10000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {key: (expires_at, value)}
+        self.lock = threading.RLock()
+    
+    def get(self, key, default=None):
+        """Return cached value, or default if missing/expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            
+            expires_at, value = entry
+            if time.time() >= expires_at:
+                del self.entries[key]
+                return default
+            
+            # Mark as recently used
+            self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        """Store value, evicting least recently used entries over the cap"""
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def pop(self, key):
+        """Invalidate a single entry, returning its value if it was still live"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or time.time() >= entry[0]:
+                return None
+            return entry[1]
+    
+    def add(self, key, value=True):
+        """Store value only if key has no live entry; True if it was stored"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() < entry[0]:
+                return False
+            self.set(key, value)
+            return True
+    
+    def values(self):
+        """Snapshot of all live values"""
+        with self.lock:
+            current_time = time.time()
+            return [value for expires_at, value in self.entries.values() if expires_at > current_time]
+    
+    def __len__(self):
+        return len(self.entries)
+
+# ============================================
+# REDIS-BACKED STATE STORE
+# ============================================
+class RedisStateStore:
+    """Session state in Redis, with the same interface as TTLCache.
+    
+    Each chat's state is one JSON value under prefix + key whose expiry is
+    pushed back on every write. The lock only serializes read-modify-write
+    within this process; across workers the last write wins. While Redis
+    is unreachable, reads and writes fall back to a bounded in-process
+    cache so handlers keep working instead of raising.
+    """
+    
+    def __init__(self, client, prefix='tg:state:', ttl=86400, fallback_maxsize=10000):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.fallback = TTLCache(maxsize=fallback_maxsize, ttl=ttl)
+    
+    def _redis_failed(self, operation, error):
+        logger.warning(f"Redis state {operation} failed, using local fallback: {error}")
+    
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            self._redis_failed('read', e)
+            return self.fallback.get(key, default)
+        if raw is None:
+            # State written while Redis was down
+            return self.fallback.get(key, default)
+        return orjson.loads(raw)
+    
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, orjson.dumps(value), ex=self.ttl)
+        except redis.RedisError as e:
+            self._redis_failed('write', e)
+            self.fallback.set(key, value)
+    
+    def pop(self, key):
+        """Delete a chat's state, returning it if it existed"""
+        local = self.fallback.pop(key)
+        try:
+            pipe = self.client.pipeline()
+            pipe.get(self.prefix + key)
+            pipe.delete(self.prefix + key)
+            raw, _ = pipe.execute()
+        except redis.RedisError as e:
+            self._redis_failed('delete', e)
+            return local
+        return orjson.loads(raw) if raw is not None else local
+    
+    def keys(self):
+        """All stored keys (scans the keyspace - metrics only)"""
+        try:
+            return list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+        except redis.RedisError as e:
+            self._redis_failed('scan', e)
+            return []
+    
+    def values(self):
+        """Snapshot of all stored states (scans the keyspace - metrics only)"""
+        keys = self.keys()
+        if not keys:
+            return self.fallback.values()
+        try:
+            raws = self.client.mget(keys)
+        except redis.RedisError as e:
+            self._redis_failed('read', e)
+            return self.fallback.values()
+        return [orjson.loads(raw) for raw in raws if raw is not None] + self.fallback.values()
+    
+    def __len__(self):
+        return len(self.keys()) + len(self.fallback)
+
+# Registered Channel_User__c records keyed by Telegram chat ID.
+# Only positive lookups are cached so a registration made by another
+# worker is picked up on the next message.
+channel_user_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CHANNEL_USER_CACHE_TTL)
+
+# Contacts found by phone number (False when none matched), plus lookups
+# currently in flight so concurrent requests for the same number share one
+# Salesforce query
+contact_phone_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CONTACT_PHONE_CACHE_TTL)
+inflight_phone_lookups = {}  # {clean_phone: Future}
+inflight_phone_lock = threading.Lock()
+
+# (channel_user, conversation) per chat ID and Chat_Session__c lists per
+# conversation, so repeat messages from a chat skip the Salesforce lookups
+user_context_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=USER_CONTEXT_CACHE_TTL)
+active_sessions_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=ACTIVE_SESSIONS_CACHE_TTL)
+
+# Last Salesforce connectivity result, so bursts of health probes
+# don't each retry the token endpoint while it is failing
+health_status_cache = TTLCache(maxsize=1, ttl=HEALTH_CHECK_CACHE_TTL)
+
+# Queue position per conversation - it barely moves while a user types several messages
+queue_position_cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=QUEUE_POSITION_CACHE_TTL)
+
+# Ordered waiting-session list per queue owner, shared by every waiting user
+queue_snapshot_cache = TTLCache(maxsize=8, ttl=QUEUE_SNAPSHOT_TTL)
+
+# Sequence for outbound message IDs; next() on itertools.count is atomic under the GIL
+message_id_sequence = itertools.count()
+
+def new_message_id(prefix, chat_id):
+    """Build a message ID that stays unique across bursts within the same second"""
+    return f"{prefix}_{time.time_ns()}_{next(message_id_sequence)}_{chat_id}"
+
+# ============================================
+# SALESFORCE CIRCUIT BREAKER
+# ============================================
+class CircuitOpenError(Exception):
+    """Raised instead of calling Salesforce while the circuit is open"""
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures, then retries after a cool-down"""
+    
+    def __init__(self, fail_max=5, window=30, reset_timeout=30):
+        self.fail_max = fail_max
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.failures = []  # timestamps of recent failures
+        self.opened_at = None
+        self.half_open = False
+        self.lock = threading.Lock()
+    
+    def allow_request(self):
+        """Check if a call may go through"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # Let trial calls through; the next failure re-opens immediately
+                self.opened_at = None
+                self.half_open = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = []
+            self.half_open = False
+    
+    def record_failure(self):
+        with self.lock:
+            current_time = time.time()
+            self.failures = [t for t in self.failures if t > current_time - self.window]
+            self.failures.append(current_time)
+            if self.opened_at is None and (self.half_open or len(self.failures) >= self.fail_max):
+                self.opened_at = current_time
+                self.half_open = False
+                logger.error(f"Salesforce circuit opened after {len(self.failures)} failures")
+
+sf_circuit_breaker = CircuitBreaker(
+    fail_max=SF_BREAKER_FAIL_MAX,
+    window=SF_BREAKER_WINDOW,
+    reset_timeout=SF_BREAKER_RESET_TIMEOUT
+)
+
+def salesforce_request(method, url, **kwargs):
+    """Call Salesforce with bounded timeouts, failing fast while the circuit is open"""
+    if not sf_circuit_breaker.allow_request():
+        raise CircuitOpenError("Salesforce circuit is open")
+    
+    kwargs.setdefault('timeout', SF_TIMEOUT)
+    try:
+        response = http_session.request(method, url, **kwargs)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        sf_circuit_breaker.record_failure()
+        raise
+    
+    if response.status_code >= 500:
+        sf_circuit_breaker.record_failure()
+    else:
+        sf_circuit_breaker.record_success()
+    return response
+
 # ============================================
 # SECURITY MIDDLEWARE
 # ============================================
+# Health/status endpoints are never rate limited
+RATE_LIMIT_EXEMPT_PATHS = frozenset({'/health', '/', '/test', '/metrics'})
+
 @app.before_request
 def security_middleware():
     """Security middleware for all requests"""
@@ -136,7 +598,7 @@ def security_middleware():
         g.client_ip = g.client_ip.split(',')[0].strip()
     
     # Skip rate limiting for health/status endpoints
-    if request.path in ['/health', '/', '/test', '/metrics']:
+    if request.path in RATE_LIMIT_EXEMPT_PATHS:
         return
     
     # Apply rate limiting
@@ -150,6 +612,27 @@ def security_middleware():
 # ============================================
 # SECURITY UTILITY FUNCTIONS
 # ============================================
+# Patterns compiled once at import; these run on every incoming message
+SF_ID_PATTERN = re.compile(r'^[a-zA-Z0-9]{15,18}$')
+NON_DIGIT_PATTERN = re.compile(r'\D')
+# str.translate deletes the ASCII non-digits faster than a regex pass on
+# short strings; NON_DIGIT_PATTERN only runs when non-ASCII text is left
+NON_DIGIT_TABLE = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isdigit()))
+PHONE_MAX_INPUT_LENGTH = 24
+ETHIOPIAN_MOBILE_PATTERN = re.compile(r'^0[79]\d{8}$')
+NON_ALNUM_PATTERN = re.compile(r'[^a-zA-Z0-9]')
+SOQL_UNSAFE_PATTERN = re.compile(r'[^\w \-\.]')
+NAME_UNSAFE_PATTERN = re.compile(r'[^\w\s\-]')
+RETRY_AFTER_PATTERN = re.compile(r'retry after (\d+)')
+
+MENU_COMMANDS = frozenset({'/start', 'hi', 'hello', 'hey', 'menu', 'help'})
+SUPPORT_COMMANDS = frozenset({'contact', 'support', 'contact support', 'customer support'})
+TRACK_COMMANDS = frozenset({'track', 'track case', 'case', 'my case'})
+NEW_SESSION_COMMANDS = frozenset({'new', 'new support', 'new session'})
+MAIN_MENU_COMMANDS = frozenset({'main menu', 'menu'})
+SUPPORT_KEYWORDS_PATTERN = re.compile(r'help|issue|problem|support')
+ALLOWED_PARSE_MODES = frozenset({'HTML', 'Markdown', 'MarkdownV2'})
+
 def sanitize_input(text, max_length=MAX_MESSAGE_LENGTH):
     """Sanitize user input to prevent injection attacks"""
     if not text or not ENABLE_INPUT_SANITIZATION:
@@ -165,42 +648,69 @@ def sanitize_input(text, max_length=MAX_MESSAGE_LENGTH):
     
     return text
 
+def serialize_reply_markup(reply_markup):
+    """Serialize reply markup for Telegram, passing pre-serialized JSON through"""
+    if isinstance(reply_markup, str):
+        return reply_markup
+    return orjson.dumps(reply_markup).decode()
+
 def sanitize_salesforce_id(sf_id):
     """Validate and sanitize Salesforce ID"""
     if not sf_id:
         return None
     
     # Salesforce IDs are 15 or 18 characters, alphanumeric
-    if not re.match(r'^[a-zA-Z0-9]{15,18}$', sf_id):
+    if not SF_ID_PATTERN.match(sf_id):
         logger.warning(f"Invalid Salesforce ID format: {sf_id}")
         return None
     
     return sf_id
 
+def soql_literal(value, prefix='', suffix=''):
+    """Quote a value for SOQL, escaping it after dropping unsafe characters.
+    
+    prefix/suffix are added unescaped inside the quotes, e.g. '%' for LIKE.
+    """
+    if value is None:
+        return "''"
+    
+    # Allow word characters, spaces, dashes and dots only - no quotes,
+    # backslashes or line breaks survive, the escapes below are a backstop
+    sanitized = SOQL_UNSAFE_PATTERN.sub('', str(value))
+    
+    if len(sanitized) > 255:
+        sanitized = sanitized[:255]
+        logger.warning("SOQL parameter truncated to 255 chars")
+    
+    sanitized = sanitized.replace('\\', '\\\\').replace("'", "\\'")
+    return f"'{prefix}{sanitized}{suffix}'"
+
 def sanitize_phone_number(phone):
     """Enhanced phone number sanitization with validation"""
-    if not phone:
+    # Even a fully formatted number ("+251 (91) 234-5678") stays well under
+    # this, so ordinary chat text is rejected before any regex work
+    if not phone or len(phone) > PHONE_MAX_INPUT_LENGTH:
         return ""
     
-    # Remove all non-digits
-    cleaned = re.sub(r'[^\d]', '', phone)
+    # Remove all non-digits (this also drops a leading '+')
+    cleaned = phone.translate(NON_DIGIT_TABLE)
+    if not cleaned.isascii():
+        cleaned = NON_DIGIT_PATTERN.sub('', cleaned)
     
     # Validate Ethiopian phone format
     if len(cleaned) < 9 or len(cleaned) > 12:
         return ""
     
-    # Handle Ethiopian country codes
+    # Handle Ethiopian country code
     if cleaned.startswith('251'):
         cleaned = cleaned[3:]
-    elif cleaned.startswith('+251'):
-        cleaned = cleaned[4:]
     
     # Ensure it starts with 0
     if not cleaned.startswith('0'):
         cleaned = '0' + cleaned
     
     # Final validation: Ethiopian mobile numbers start with 09 or 07
-    if not re.match(r'^0[79]\d{8}$', cleaned):
+    if not ETHIOPIAN_MOBILE_PATTERN.match(cleaned):
         return ""
     
     return cleaned
@@ -239,41 +749,103 @@ def validate_telegram_payload(payload):
 # ENHANCED SALESFORCE AUTH WITH SECURITY
 # ============================================
 class SalesforceAuth:
-    """Handles Salesforce OAuth 2.0 authentication with security enhancements"""
+    """Handles Salesforce OAuth 2.0 authentication with security enhancements.
     
-    def __init__(self):
-        self.instance_url = SF_INSTANCE_URL.rstrip('/')
+    With a Redis client the token is also kept under TOKEN_KEY, so a
+    restarted or newly forked worker reuses it instead of calling the
+    token endpoint again.
+    """
+    TOKEN_KEY = 'sf:token'
+    
+    def __init__(self, client=None):
+        self.instance_url = SF_INSTANCE_URL
         self.client_id = SF_CLIENT_ID
         self.client_secret = SF_CLIENT_SECRET
+        self.use_jwt = USE_JWT_BEARER
+        self.client = client
         self.access_token = None
         self.token_expiry = 0
-        self.token_lock = False
+        self.refresh_lock = threading.Lock()
+        if client is not None:
+            self._load_shared_token()
+    
+    def _has_fresh_token(self):
+        """Check the cached token is valid for at least TOKEN_REFRESH_MARGIN more seconds"""
+        return bool(self.access_token) and time.time() < (self.token_expiry - TOKEN_REFRESH_MARGIN)
     
     def get_access_token(self):
-        """Get Salesforce access token with enhanced security"""
-        try:
-            # Check cached token with safety margin
-            if self.access_token and time.time() < (self.token_expiry - 300):
-                logger.debug("Using cached Salesforce access token")
+        """Get Salesforce access token, refreshing it only near expiry"""
+        if self._has_fresh_token():
+            return self.access_token
+        
+        # Single-flight refresh: concurrent callers wait for one token request
+        with self.refresh_lock:
+            if self._has_fresh_token():
                 return self.access_token
-            
-            # Prevent multiple concurrent token requests
-            if self.token_lock:
-                wait_time = 0
-                while self.token_lock and wait_time < 5:
-                    time.sleep(0.1)
-                    wait_time += 0.1
-                if self.access_token and time.time() < (self.token_expiry - 300):
-                    return self.access_token
-            
-            self.token_lock = True
-            
-            token_url = f"{self.instance_url}/services/oauth2/token"
-            payload = {
-                'grant_type': 'client_credentials',
-                'client_id': self.client_id,
-                'client_secret': self.client_secret
-            }
+            # Another worker may already have refreshed it
+            if self.client is not None and self._load_shared_token():
+                return self.access_token
+            return self._request_access_token()
+    
+    def invalidate(self, stale_token=None):
+        """Drop the cached token so the next call fetches a new one.
+        
+        With stale_token, only drop it if it is still the cached token, so a
+        burst of 401s for one expired token triggers a single refresh.
+        """
+        with self.refresh_lock:
+            if stale_token is None or stale_token == self.access_token:
+                self.access_token = None
+                self.token_expiry = 0
+            if self.client is not None:
+                try:
+                    shared = self.client.get(self.TOKEN_KEY)
+                    if shared is not None and (stale_token is None or shared.decode() == stale_token):
+                        self.client.delete(self.TOKEN_KEY)
+                except redis.RedisError as e:
+                    logger.warning(f"Could not drop shared Salesforce token: {e}")
+    
+    def _load_shared_token(self):
+        """Adopt the token stored in Redis if it is still fresh; True if adopted"""
+        try:
+            pipe = self.client.pipeline()
+            pipe.get(self.TOKEN_KEY)
+            pipe.ttl(self.TOKEN_KEY)
+            token, ttl = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not read shared Salesforce token: {e}")
+            return False
+        
+        if token is None or ttl <= 0:
+            return False
+        # The key expires TOKEN_REFRESH_MARGIN before the token itself
+        self.access_token = token.decode()
+        self.token_expiry = time.time() + ttl + TOKEN_REFRESH_MARGIN
+        logger.info("Using shared Salesforce access token")
+        return True
+    
+    def _publish_token(self, expires_in):
+        """Store a freshly issued token for other workers and restarts"""
+        try:
+            self.client.set(self.TOKEN_KEY, self.access_token, ex=max(1, int(expires_in) - TOKEN_REFRESH_MARGIN))
+        except redis.RedisError as e:
+            logger.warning(f"Could not share Salesforce token: {e}")
+    
+    def _request_access_token(self):
+        """Request a new access token from Salesforce"""
+        try:
+            token_url = SF_TOKEN_URL
+            if self.use_jwt:
+                payload = {
+                    'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+                    'assertion': self._build_jwt_assertion()
+                }
+            else:
+                payload = {
+                    'grant_type': 'client_credentials',
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret
+                }
             
             headers = {
                 'Content-Type': 'application/x-www-form-urlencoded',
@@ -281,19 +853,21 @@ class SalesforceAuth:
             }
             
             logger.info("Requesting Salesforce access token...")
-            response = requests.post(
+            response = salesforce_request(
+                'POST',
                 token_url, 
                 data=payload, 
                 headers=headers, 
-                timeout=REQUEST_TIMEOUT,
                 verify=True
             )
             
             if response.status_code == 200:
-                token_data = response.json()
+                token_data = orjson.loads(response.content)
                 self.access_token = token_data.get('access_token')
                 expires_in = token_data.get('expires_in', 3600)
                 self.token_expiry = time.time() + expires_in
+                if self.client is not None and self.access_token:
+                    self._publish_token(expires_in)
                 
                 # Log token acquisition (without exposing token)
                 token_prefix = self.access_token[:10] + '...' if self.access_token else 'None'
@@ -312,8 +886,205 @@ class SalesforceAuth:
         except Exception as e:
             logger.error(f"Token exception: {str(e)[:100]}")
             return None
+    
+    def _build_jwt_assertion(self):
+        """Build a signed JWT assertion for the OAuth 2.0 JWT Bearer flow"""
+        claims = {
+            'iss': self.client_id,
+            'sub': SF_USERNAME,
+            'aud': SF_LOGIN_URL,
+            'exp': int(time.time()) + 300
+        }
+        return jwt.encode(claims, SF_PRIVATE_KEY, algorithm='RS256')
+
+# ============================================
+# OUTBOUND MESSAGE COALESCING
+# ============================================
+class PendingSend:
+    """Outcome of a buffered message; its truth value waits for the delivery result"""
+    
+    def __init__(self):
+        self.future = Future()
+    
+    def __bool__(self):
+        try:
+            return bool(self.future.result(timeout=REQUEST_TIMEOUT))
+        except Exception:
+            return False
+
+class SendCoalescer:
+    """Merges back-to-back messages to the same chat into one sendMessage call.
+    
+    Only active on threads between start() and flush(), which wrap each
+    background update handler. A message is held for up to `window` seconds
+    so the next one for the chat can join it (joined with a blank line).
+    A batch goes out early when a message brings a keyboard - it has to stay
+    on the last message - or the parse_mode changes, and flush() sends what
+    the handler left behind. Text over Telegram's limit is split on
+    paragraph boundaries. Batches for a chat are delivered in order.
+    """
+    
+    def __init__(self, deliver, window=SEND_COALESCE_WINDOW, max_length=TELEGRAM_MAX_MESSAGE_LENGTH):
+        self.deliver = deliver
+        self.window = window
+        self.max_length = max_length
+        self.batches = {}  # {chat_id: open batch}
+        self.tails = {}  # {chat_id: PendingSend of the last batch handed to delivery}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    
+    def start(self):
+        """Begin buffering messages sent from the current thread"""
+        self.local.chats = set()
+    
+    def add(self, chat_id, text, reply_markup, parse_mode):
+        """Buffer a message; returns its PendingSend, or None if buffering is not active"""
+        chats = getattr(self.local, 'chats', None)
+        if chats is None:
+            return None
+        chats.add(chat_id)
+        
+        ready = []
+        with self.lock:
+            batch = self.batches.get(chat_id)
+            if batch is not None and batch['parse_mode'] != parse_mode:
+                ready.append(self._close(chat_id))
+                batch = None
+            
+            if batch is None:
+                batch = {
+                    'chat_id': chat_id,
+                    'texts': [],
+                    'reply_markup': None,
+                    'parse_mode': parse_mode,
+                    'result': PendingSend(),
+                    'timer': threading.Timer(self.window, self._flush_chat, (chat_id,))
+                }
+                batch['timer'].daemon = True
+                self.batches[chat_id] = batch
+                batch['timer'].start()
+            
+            batch['texts'].append(text)
+            if reply_markup:
+                batch['reply_markup'] = reply_markup
+                ready.append(self._close(chat_id))
+        
+        for closed in ready:
+            self._send(closed)
+        return batch['result']
+    
+    def flush(self):
+        """Send everything the current thread left buffered and stop buffering"""
+        chats = getattr(self.local, 'chats', None) or ()
+        self.local.chats = None
+        for chat_id in chats:
+            self._flush_chat(chat_id)
+    
+    def _flush_chat(self, chat_id):
+        with self.lock:
+            if chat_id not in self.batches:
+                return
+            batch = self._close(chat_id)
+        self._send(batch)
+    
+    def _close(self, chat_id):
+        """Detach a chat's open batch and queue it behind the chat's last one (lock held)"""
+        batch = self.batches.pop(chat_id)
+        batch['timer'].cancel()
+        batch['after'] = self.tails.get(chat_id)
+        self.tails[chat_id] = batch['result']
+        return batch
+    
+    def _split(self, text):
+        """Split text into chunks within the limit, preferring paragraph boundaries"""
+        chunks = []
+        current = ''
+        for paragraph in text.split('\n\n'):
+            while len(paragraph) > self.max_length:
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.append(paragraph[:self.max_length])
+                paragraph = paragraph[self.max_length:]
+            if current and len(current) + 2 + len(paragraph) > self.max_length:
+                chunks.append(current)
+                current = paragraph
+            else:
+                current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current or not chunks:
+            chunks.append(current)
+        return chunks
+    
+    def _send(self, batch):
+        """Deliver a closed batch after the chat's previous one, then publish the result"""
+        chat_id = batch['chat_id']
+        previous = batch['after']
+        if previous is not None:
+            # Keep the chat's messages in the order they were sent
+            try:
+                previous.future.result(timeout=REQUEST_TIMEOUT)
+            except Exception:
+                pass
+        
+        ok = True
+        try:
+            chunks = self._split('\n\n'.join(batch['texts']))
+            for index, chunk in enumerate(chunks):
+                # The keyboard belongs under the last chunk
+                markup = batch['reply_markup'] if index == len(chunks) - 1 else None
+                ok = self.deliver(chat_id, chunk, markup, batch['parse_mode']) and ok
+        except Exception as e:
+            logger.error(f"Error sending coalesced messages to {chat_id}: {e}")
+            ok = False
         finally:
-            self.token_lock = False
+            batch['result'].future.set_result(ok)
+            with self.lock:
+                if self.tails.get(chat_id) is batch['result']:
+                    del self.tails[chat_id]
+
+# ============================================
+# OUTBOUND RATE LIMITING
+# ============================================
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping only as long as the refill needs"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+# Telegram allows ~30 msg/s overall and ~1 msg/s per chat; pacing sends
+# below that keeps us from hitting 429s and their multi-second retry_after
+telegram_send_bucket = TokenBucket(rate=TELEGRAM_RATE_LIMIT, capacity=TELEGRAM_RATE_LIMIT)
+chat_send_buckets = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=60)
+chat_send_buckets_lock = threading.Lock()
+
+def throttle_telegram_send(chat_id):
+    """Block until both the per-chat and the global send budget allow a message"""
+    chat_key = str(chat_id)
+    with chat_send_buckets_lock:
+        bucket = chat_send_buckets.get(chat_key)
+        if bucket is None:
+            bucket = TokenBucket(rate=TELEGRAM_CHAT_RATE_LIMIT, capacity=TELEGRAM_CHAT_BURST)
+            chat_send_buckets.set(chat_key, bucket)
+    # Wait on the chat first so a slow chat never holds a global token
+    bucket.acquire()
+    telegram_send_bucket.acquire()
 
 # ============================================
 # ENHANCED TELEGRAM BOT MANAGER WITH SECURITY
@@ -325,7 +1096,7 @@ class TelegramBotManager:
     def answer_callback_query(self, callback_query_id, text=None, show_alert=False):
         """Answer a callback query"""
         try:
-            url = f"{self.base_url}/answerCallbackQuery"
+            url = TELEGRAM_ANSWER_CALLBACK_URL
             data = {
                 'callback_query_id': callback_query_id,
                 'show_alert': show_alert
@@ -334,7 +1105,7 @@ class TelegramBotManager:
                 data['text'] = text[:200]  # Telegram has 200 char limit for this
                 
             response = self._execute_safe_request(url, data=data)
-            return response.json().get('ok', False)
+            return orjson.loads(response.content).get('ok', False)
         except Exception as e:
             logger.error(f"Error answering callback query: {e}")
             return False
@@ -342,16 +1113,16 @@ class TelegramBotManager:
     def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
         """Edit message reply markup (remove buttons)"""
         try:
-            url = f"{self.base_url}/editMessageReplyMarkup"
+            url = TELEGRAM_EDIT_MARKUP_URL
             data = {
                 'chat_id': chat_id,
                 'message_id': message_id
             }
             if reply_markup:
-                data['reply_markup'] = json.dumps(reply_markup)
+                data['reply_markup'] = serialize_reply_markup(reply_markup)
                 
             response = self._execute_safe_request(url, data=data)
-            return response.json().get('ok', False)
+            return orjson.loads(response.content).get('ok', False)
         except Exception as e:
             logger.error(f"Error editing message markup: {e}")
             return False
@@ -359,32 +1130,41 @@ class TelegramBotManager:
 
     def __init__(self):
         self.bot_token = BOT_TOKEN
-        if self.bot_token:
-            self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
-        else:
-            self.base_url = None
-            
+        self.base_url = TELEGRAM_API_BASE
         self.sf_webhook = SALESFORCE_WEBHOOK_URL
-        self.sf_auth = SalesforceAuth()
+        self.sf_auth = SalesforceAuth(redis_client)
+        self._cached_sf_headers = (None, None)  # (access_token, headers)
+        self.coalescer = SendCoalescer(self._deliver_message)
+        # Prime the token so the first message in a fresh worker skips the round-trip
+        self.sf_auth.get_access_token()
+        
+    def _sf_headers(self, access_token):
+        """Salesforce API headers, rebuilt only when the access token rotates.
         
+        The returned dict is shared between calls and must not be modified.
+        """
+        cached_token, headers = self._cached_sf_headers
+        if cached_token != access_token:
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            self._cached_sf_headers = (access_token, headers)
+        return headers
+    
     def _execute_safe_request(self, url, method='POST', **kwargs):
         """Execute HTTP request with enhanced security"""
         try:
             # Set default timeout
             kwargs.setdefault('timeout', REQUEST_TIMEOUT)
             
-            # Add security headers
-            headers = kwargs.get('headers', {})
-            headers['User-Agent'] = 'Telegram-Support-Bot/1.0'
-            kwargs['headers'] = headers
-            
             # Execute request
             if method.upper() == 'POST':
-                response = requests.post(url, **kwargs)
+                response = http_session.post(url, **kwargs)
             elif method.upper() == 'GET':
-                response = requests.get(url, **kwargs)
+                response = http_session.get(url, **kwargs)
             elif method.upper() == 'PATCH':
-                response = requests.patch(url, **kwargs)
+                response = http_session.patch(url, **kwargs)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
             
@@ -405,15 +1185,20 @@ class TelegramBotManager:
     
     def send_message(self, chat_id, text, reply_markup=None, parse_mode='HTML'):
         """Send message to Telegram with security enhancements"""
+        # Sanitize message text
+        safe_text = sanitize_input(text)
+        
+        # Inside an update handler, back-to-back messages to a chat are merged
+        pending = self.coalescer.add(chat_id, safe_text, reply_markup, parse_mode)
+        if pending is not None:
+            return pending
+        
+        return self._deliver_message(chat_id, safe_text, reply_markup, parse_mode)
+    
+    def _deliver_message(self, chat_id, safe_text, reply_markup=None, parse_mode='HTML'):
+        """Send an already sanitized message to Telegram, retrying on rate limits"""
         try:
-            if not self.base_url:
-                logger.error("BOT_TOKEN not configured")
-                return False
-            
-            # Sanitize message text
-            safe_text = sanitize_input(text)
-            
-            url = f"{self.base_url}/sendMessage"
+            url = TELEGRAM_SEND_URL
             data = {
                 'chat_id': chat_id,
                 'text': safe_text,
@@ -421,29 +1206,32 @@ class TelegramBotManager:
             }
             
             if reply_markup:
-                data['reply_markup'] = json.dumps(reply_markup)
+                # Static menus are passed in already serialized
+                data['reply_markup'] = serialize_reply_markup(reply_markup)
             
             # Retry logic with exponential backoff
             max_retries = 3
             for attempt in range(max_retries):
                 try:
+                    throttle_telegram_send(chat_id)
                     response = self._execute_safe_request(url, data=data)
-                    result = response.json()
+                    result = orjson.loads(response.content)
                     
                     if result.get('ok'):
-                        logger.info(f"Message sent to {chat_id}")
+                        logger.info("Message sent to %s", chat_id)
                         return True
                     else:
                         error_desc = result.get('description', 'Unknown error')
                         
                         # Handle rate limits from Telegram
-                        if "retry after" in error_desc.lower() and attempt < max_retries - 1:
-                            match = re.search(r'retry after (\d+)', error_desc.lower())
-                            if match:
-                                wait_time = int(match.group(1))
-                                logger.warning(f"Telegram rate limit, waiting {wait_time}s")
-                                time.sleep(wait_time)
-                                continue
+                        wait_time = (result.get('parameters') or {}).get('retry_after')
+                        if wait_time is None:
+                            match = RETRY_AFTER_PATTERN.search(error_desc.lower())
+                            wait_time = int(match.group(1)) if match else None
+                        if wait_time and attempt < max_retries - 1:
+                            logger.warning(f"Telegram rate limit, waiting {wait_time}s")
+                            time.sleep(wait_time)
+                            continue
                         
                         logger.error(f"Failed to send to {chat_id}: {error_desc}")
                         return False
@@ -463,10 +1251,6 @@ class TelegramBotManager:
     def forward_to_salesforce(self, payload):
         """Forward message to Salesforce with enhanced security"""
         try:
-            if not self.sf_webhook:
-                logger.error("SALESFORCE_WEBHOOK_URL not configured")
-                return False
-            
             # Get Salesforce access token
             access_token = self.sf_auth.get_access_token()
             if not access_token:
@@ -476,50 +1260,51 @@ class TelegramBotManager:
             # Sanitize payload
             safe_payload = self._sanitize_payload(payload)
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json',
-                'User-Agent': 'Telegram-Support-Bot/1.0'
-            }
+            headers = self._sf_headers(access_token)
             
-            logger.info(f"Forwarding to Salesforce webhook")
+            logger.info("Forwarding to Salesforce webhook")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Salesforce payload: %s", orjson.dumps(safe_payload).decode())
             
             # Retry logic for Salesforce
             max_retries = 3
             for attempt in range(max_retries):
                 try:
-                    response = self._execute_safe_request(
+                    response = salesforce_request(
+                        'POST',
                         self.sf_webhook,
-                        json=safe_payload,
+                        data=orjson.dumps(safe_payload),
                         headers=headers
                     )
                     
                     if response.status_code == 200:
-                        logger.info(f"Forwarded to Salesforce: {safe_payload.get('chatId')}")
+                        logger.info("Forwarded to Salesforce: %s", safe_payload.get('chatId'))
                         return True
                     elif response.status_code == 401 and attempt < max_retries - 1:
                         # Token expired, refresh and retry
-                        logger.warning(f"Auth failed, refreshing token and retrying")
-                        self.sf_auth.access_token = None
-                        self.sf_auth.token_expiry = 0
+                        logger.warning("Auth failed, refreshing token and retrying")
+                        self.sf_auth.invalidate(access_token)
                         access_token = self.sf_auth.get_access_token()
                         if access_token:
-                            headers['Authorization'] = f'Bearer {access_token}'
+                            headers = self._sf_headers(access_token)
                         time.sleep(1)
                         continue
                     else:
-                        logger.error(f"Salesforce error {response.status_code}")
+                        logger.error("Salesforce error %s", response.status_code)
                         return False
                         
+                except CircuitOpenError:
+                    logger.warning("Salesforce circuit open, not forwarding")
+                    return False
                 except Exception as e:
                     if attempt < max_retries - 1:
-                        logger.warning(f"Salesforce request failed, retry {attempt + 1}/{max_retries}")
+                        logger.warning("Salesforce request failed, retry %s/%s", attempt + 1, max_retries)
                         time.sleep(2)
                         continue
                     raise
                 
         except Exception as e:
-            logger.error(f"Error forwarding to Salesforce: {str(e)[:100]}")
+            logger.error("Error forwarding to Salesforce: %s", str(e)[:100])
             return False
     
     def _sanitize_payload(self, payload):
@@ -538,45 +1323,25 @@ class TelegramBotManager:
             if field in safe_payload:
                 # Remove any non-alphanumeric characters from IDs
                 if safe_payload[field]:
-                    safe_payload[field] = re.sub(r'[^a-zA-Z0-9]', '', str(safe_payload[field]))
+                    safe_payload[field] = NON_ALNUM_PATTERN.sub('', str(safe_payload[field]))
         
         return safe_payload
     
     def _sanitize_sql_param(self, param):
         """Sanitize parameters for SOQL queries"""
-        if param is None:
-            return "''"
-        
-        param_str = str(param)
-        
-        # Remove potentially dangerous characters
-        # Allow alphanumeric, spaces, underscores, dashes, dots
-        sanitized = re.sub(r'[^\w\s\-\.]', '', param_str)
-        
-        # Escape single quotes for SOQL
-        sanitized = sanitized.replace("'", "\\'")
-        
-        # Limit length
-        if len(sanitized) > 255:
-            sanitized = sanitized[:255]
-            logger.warning(f"SQL parameter truncated to 255 chars")
-        
-        return f"'{sanitized}'" if sanitized else "''"
+        return soql_literal(param)
     
     def send_typing_action(self, chat_id):
         """Send typing action to Telegram"""
         try:
-            if not self.base_url:
-                return False
-                
-            url = f"{self.base_url}/sendChatAction"
+            url = TELEGRAM_CHAT_ACTION_URL
             data = {
                 'chat_id': chat_id,
                 'action': 'typing'
             }
             
-            response = requests.post(url, data=data, timeout=5)
-            return response.json().get('ok', False)
+            response = http_session.post(url, data=data, timeout=TYPING_ACTION_TIMEOUT)
+            return orjson.loads(response.content).get('ok', False)
                 
         except Exception as e:
             logger.error(f"Error sending typing action: {e}")
@@ -588,38 +1353,29 @@ class TelegramBotManager:
     
     def check_existing_channel_user(self, telegram_id):
         """Check if Channel_User__c exists by Telegram Chat ID with SQL injection protection"""
+        cached = channel_user_cache.get(str(telegram_id))
+        if cached:
+            return cached
+        
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
             # Sanitize input
             sanitized_id = self._sanitize_sql_param(telegram_id)
             
-            query = f"""
-            SELECT Id, Name, Channel_Type__c, Channel_ID__c,
-                   Telegram_Chat_ID__c, Contact__c, Contact__r.Name,
-                   Contact__r.FirstName, Contact__r.LastName,
-                   Created_Date__c, Last_Activity_Date__c
-            FROM Channel_User__c 
-            WHERE Channel_Type__c = 'Telegram' 
-            AND Telegram_Chat_ID__c = {sanitized_id}
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
-            
-            response = requests.get(url, headers=headers, timeout=30)
+            query = CHANNEL_USER_QUERY.format(chat_id=sanitized_id)
+            response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': query})
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 if data['totalSize'] > 0:
-                    return data['records'][0]
+                    channel_user = data['records'][0]
+                    channel_user_cache.set(str(telegram_id), channel_user)
+                    return channel_user
             return None
             
         except Exception as e:
@@ -627,127 +1383,216 @@ class TelegramBotManager:
             return None
     
     def find_contact_by_phone(self, phone_number):
-        """Find contact by phone number in Salesforce with SQL injection protection"""
+        """Find contact by phone number, sharing one Salesforce query between concurrent callers"""
+        clean_phone = self.clean_phone_number(phone_number)
+        if not clean_phone:
+            return None
+        
+        cached = contact_phone_cache.get(clean_phone)
+        if cached is not None:
+            return cached or None
+        
+        # Join an identical lookup that is already in flight
+        with inflight_phone_lock:
+            future = inflight_phone_lookups.get(clean_phone)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                inflight_phone_lookups[clean_phone] = future
+        
+        if not is_owner:
+            try:
+                return future.result(timeout=REQUEST_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error waiting for phone lookup: {e}")
+                return None
+        
+        contact = None
+        try:
+            contact = self._query_contact_by_phone(clean_phone)
+            if contact is not None:
+                contact_phone_cache.set(clean_phone, contact)
+            contact = contact or None
+        finally:
+            future.set_result(contact)
+            with inflight_phone_lock:
+                inflight_phone_lookups.pop(clean_phone, None)
+        
+        return contact
+    
+    def _query_contact_by_phone(self, clean_phone):
+        """Query Contact by cleaned phone number with SQL injection protection
+        
+        Returns the contact, False if none matched, or None if the query failed.
+        """
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
-            clean_phone = self.clean_phone_number(phone_number)
-            if not clean_phone:
-                return None
-            
-            # Use LIKE with sanitized input
-            sanitized_phone = self._sanitize_sql_param(f"%{clean_phone}")
-            
-            query = f"""
-            SELECT Id, FirstName, LastName, Salutation, Phone, MobilePhone, Email 
-            FROM Contact 
-            WHERE Phone LIKE {sanitized_phone}
-               OR MobilePhone LIKE {sanitized_phone}
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
-            
-            response = requests.get(url, headers=headers, timeout=30)
+            # Match stored numbers ending in these digits (with or without country code);
+            # the wildcard goes outside the escaping, which would strip it
+            query = CONTACT_BY_PHONE_QUERY.format(pattern=soql_literal(clean_phone.lstrip('0'), prefix='%'))
+            response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': query})
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 if data['totalSize'] > 0:
                     return data['records'][0]
+                return False
             return None
             
         except Exception as e:
             logger.error(f"Error finding contact by phone: {e}")
             return None
     
-    def get_active_support_conversation(self, channel_user_id):
-        """Get active Support Conversation for a channel user"""
+    def get_channel_user_and_active_conversation(self, telegram_id):
+        """Get Channel_User__c and its active Support Conversation in one query
+
+        Returns a (channel_user, conversation) tuple; either may be None.
+        """
+        try:
+            access_token = self.sf_auth.get_access_token()
+            if not access_token:
+                return None, None
+
+            headers = self._sf_headers(access_token)
+
+            # Sanitize input
+            sanitized_id = self._sanitize_sql_param(telegram_id)
+
+            query = self._channel_user_context_query(sanitized_id)
+            response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': query})
+
+            if response.status_code == 200:
+                return self._split_channel_user_context(telegram_id, orjson.loads(response.content))
+            return None, None
+
+        except Exception as e:
+            logger.error(f"Error getting channel user and conversation: {e}")
+            return None, None
+    
+    def _channel_user_context_query(self, sanitized_id):
+        """SOQL for a Telegram channel user with its active conversation as a subquery"""
+        return CHANNEL_USER_CONTEXT_QUERY.format(chat_id=sanitized_id)
+    
+    def _active_sessions_query(self, conversation_ref):
+        """SOQL for the latest Active/Waiting session of a conversation (ID or composite reference)"""
+        return ACTIVE_SESSIONS_QUERY.format(conversation_ref=conversation_ref)
+    
+    def _split_channel_user_context(self, telegram_id, data):
+        """Split a channel user query result into (channel_user, conversation)"""
+        if data['totalSize'] == 0:
+            return None, None
+        
+        channel_user = data['records'][0]
+        # Subquery is null when there are no matching children
+        conversations = (channel_user.pop('Support_Conversations__r', None) or {}).get('records', [])
+        channel_user_cache.set(str(telegram_id), channel_user)
+        return channel_user, (conversations[0] if conversations else None)
+    
+    def get_full_user_context(self, telegram_id):
+        """Get channel user, active conversation and its sessions in one composite call
+
+        Returns a dict with 'channel_user', 'conversation' and 'active_sessions';
+        any of them may be None (active_sessions when that subrequest failed).
+        Returns None if Salesforce could not be reached.
+        """
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
+            headers = self._sf_headers(access_token)
+            sanitized_id = self._sanitize_sql_param(telegram_id)
+            
+            # The sessions query references the conversation found by the first one
+            conversation_ref = '@{userContext.records[0].Support_Conversations__r.records[0].Id}'
+            composite_body = {
+                'allOrNone': False,
+                'compositeRequest': [
+                    {
+                        'method': 'GET',
+                        'url': self._composite_query_url(self._channel_user_context_query(sanitized_id)),
+                        'referenceId': 'userContext'
+                    },
+                    {
+                        'method': 'GET',
+                        'url': self._composite_query_url(self._active_sessions_query(conversation_ref)),
+                        'referenceId': 'activeSessions'
+                    }
+                ]
             }
             
-            # Sanitize input
-            sanitized_id = sanitize_salesforce_id(channel_user_id)
-            if not sanitized_id:
+            response = salesforce_request('POST', SF_COMPOSITE_URL, headers=headers, data=orjson.dumps(composite_body))
+            if response.status_code != 200:
+                logger.error(f"User context composite failed: {response.status_code}")
                 return None
             
-            query = f"""
-            SELECT Id, Name, Status__c, Channel_User_Name__c,
-                   Created_Date__c, Last_Activity_Date__c,
-                   Last_Message_Date__c
-            FROM Support_Conversation__c 
-            WHERE Channel_User_Name__c = '{sanitized_id}'
-            AND Status__c = 'Active'
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
+            results = {
+                sub['referenceId']: sub
+                for sub in orjson.loads(response.content).get('compositeResponse', [])
+            }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            user_result = results.get('userContext', {})
+            if user_result.get('httpStatusCode') != 200:
+                logger.error(f"User context query failed: {user_result.get('httpStatusCode')}")
+                return None
             
-            if response.status_code == 200:
-                data = response.json()
-                if data['totalSize'] > 0:
-                    return data['records'][0]
-            return None
+            channel_user, conversation = self._split_channel_user_context(telegram_id, user_result['body'])
+            
+            # Sessions subrequest fails by design when there is no conversation to
+            # reference; otherwise a failure leaves active_sessions as None (unknown)
+            sessions_result = results.get('activeSessions', {})
+            active_sessions = [] if not conversation else None
+            if conversation and sessions_result.get('httpStatusCode') == 200:
+                active_sessions = sessions_result['body'].get('records', [])
+            
+            return {
+                'channel_user': channel_user,
+                'conversation': conversation,
+                'active_sessions': active_sessions
+            }
             
         except Exception as e:
-            logger.error(f"Error getting active conversation: {e}")
+            logger.error(f"Error getting full user context: {e}")
             return None
     
+    def _composite_query_url(self, query):
+        """Relative query URL for a composite subrequest, leaving @{...} references intact"""
+        encoded_query = quote_plus(' '.join(query.split()), safe="'@{}[]")
+        return f"{SF_API_PATH}/query?q={encoded_query}"
+    
     def get_active_sessions(self, conversation_id):
-        """Get active chat sessions for a conversation"""
+        """Get active chat sessions for a conversation.
+        
+        Returns a list (empty when there are none), or None if the lookup failed.
+        """
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
-                return []
+                return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
             # Sanitize input
             sanitized_id = sanitize_salesforce_id(conversation_id)
             if not sanitized_id:
-                return []
-            
-            query = f"""
-            SELECT Id, Name, Status__c, OwnerId, Owner.Name, 
-                   Assigned_Agent__c, Assigned_Agent__r.Name,
-                   Created_Date__c, Last_Message_Time__c
-            FROM Chat_Session__c 
-            WHERE Support_Conversation__c = '{sanitized_id}'
-            AND Status__c IN ('Active', 'Waiting')
-            ORDER BY Created_Date__c DESC
-            LIMIT 1
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
-            
-            response = requests.get(url, headers=headers, timeout=30)
+                return None
+            
+            query = self._active_sessions_query(sanitized_id)
+            response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': query})
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get('records', [])
-            return []
+            return None
             
         except Exception as e:
             logger.error(f"Error getting active sessions: {e}")
-            return []
+            return None
     
     def create_channel_user_with_conversation(self, telegram_id, phone=None, contact_id=None, first_name=None, last_name=None, user_phone=None):
         """Create Channel_User__c AND Support_Conversation__c together with sanitized data"""
@@ -756,17 +1601,11 @@ class TelegramBotManager:
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            # 1. CREATE CHANNEL USER
-            channel_user_url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Channel_User__c/"
+            headers = self._sf_headers(access_token)
             
             # Sanitize inputs for name
-            safe_first_name = re.sub(r'[^\w\s\-]', '', first_name or '')[:40]
-            safe_last_name = re.sub(r'[^\w\s\-]', '', last_name or '')[:40]
+            safe_first_name = NAME_UNSAFE_PATTERN.sub('', first_name or '')[:40]
+            safe_last_name = NAME_UNSAFE_PATTERN.sub('', last_name or '')[:40]
             
             # Generate name from first and last name
             if safe_first_name and safe_last_name:
@@ -783,60 +1622,97 @@ class TelegramBotManager:
             # Truncate name if too long
             name = name[:80]
             
+            # One timestamp for every record created below
+            now_iso = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+            
+            # 1. CHANNEL USER
             channel_user_data = {
                 'Channel_Type__c': 'Telegram',
                 'Channel_ID__c': f'telegram_{telegram_id}'[:80],
                 'Telegram_Chat_ID__c': str(telegram_id),
                 'Name': name,
-                'Created_Date__c': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
-                'Last_Activity_Date__c': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+                'Created_Date__c': now_iso,
+                'Last_Activity_Date__c': now_iso
             }
             
             # Add Mobile_Number__c field if phone is provided
             if user_phone:
                 channel_user_data['Mobile_Number__c'] = user_phone
             
+            has_contact = bool(contact_id and SF_ID_PATTERN.match(contact_id))
+            
             # Add contact relationship if available and valid
-            if contact_id and re.match(r'^[a-zA-Z0-9]{15,18}$', contact_id):
+            if has_contact:
                 channel_user_data['Contact__c'] = contact_id
             
-            logger.info(f"Creating Channel User for {telegram_id} with name: {name}, phone: {user_phone}")
-            response = requests.post(channel_user_url, headers=headers, json=channel_user_data, timeout=30)
+            # 2. SUPPORT CONVERSATION (Active state), linked via composite reference
+            conversation_data = {
+                'Channel_User_Name__c': '@{channelUser.id}',
+                'Status__c': 'Active',
+                'Created_Date__c': now_iso,
+                'Last_Activity_Date__c': now_iso,
+                'Last_Message_Date__c': now_iso
+            }
             
-            if response.status_code != 201:
-                logger.error(f"Failed to create Channel_User__c: {response.status_code}")
-                return None
+            composite_requests = [
+                {
+                    'method': 'POST',
+                    'url': f'{SF_API_PATH}/sobjects/Channel_User__c',
+                    'referenceId': 'channelUser',
+                    'body': channel_user_data
+                },
+                {
+                    'method': 'POST',
+                    'url': f'{SF_API_PATH}/sobjects/Support_Conversation__c',
+                    'referenceId': 'conversation',
+                    'body': conversation_data
+                }
+            ]
+            
+            # Both records are created in one atomic round trip
+            composite_url = SF_COMPOSITE_URL
+            composite_body = {
+                'allOrNone': True,
+                'compositeRequest': composite_requests
+            }
             
-            channel_user_result = response.json()
-            channel_user_id = channel_user_result['id']
-            logger.info(f"Created Channel_User__c: {channel_user_id}")
+            logger.info(f"Creating Channel User and Conversation for {telegram_id} with name: {name}, phone: {user_phone}")
+            response = salesforce_request('POST', composite_url, headers=headers, data=orjson.dumps(composite_body))
             
-            # 2. CREATE SUPPORT CONVERSATION (Active state)
-            conversation_url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Support_Conversation__c/"
+            if response.status_code != 200:
+                logger.error(f"Composite request failed: {response.status_code}")
+                return None
             
-            conversation_data = {
-                'Channel_User_Name__c': channel_user_id,
-                'Status__c': 'Active',
-                'Created_Date__c': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
-                'Last_Activity_Date__c': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
-                'Last_Message_Date__c': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+            results = {
+                item.get('referenceId'): item
+                for item in orjson.loads(response.content).get('compositeResponse', [])
             }
             
-            logger.info(f"Creating Support Conversation for Channel User {channel_user_id}")
-            response = requests.post(conversation_url, headers=headers, json=conversation_data, timeout=30)
+            channel_user_result = results.get('channelUser', {})
+            conversation_result = results.get('conversation', {})
+            if channel_user_result.get('httpStatusCode') != 201 or conversation_result.get('httpStatusCode') != 201:
+                logger.error(
+                    f"Failed to create Channel_User__c/Support_Conversation__c: "
+                    f"{channel_user_result.get('httpStatusCode')}/{conversation_result.get('httpStatusCode')}"
+                )
+                return None
             
-            if response.status_code != 201:
-                logger.error(f"Failed to create Support_Conversation__c: {response.status_code}")
-                # Channel user was created, but conversation failed - return channel user ID only
-                return {'channelUserId': channel_user_id, 'conversationId': None}
+            channel_user_id = channel_user_result['body']['id']
+            conversation_id = conversation_result['body']['id']
+            logger.info(f"Created Channel_User__c: {channel_user_id}, Support_Conversation__c: {conversation_id}")
             
-            conversation_result = response.json()
-            conversation_id = conversation_result['id']
-            logger.info(f"Created Support_Conversation__c: {conversation_id}")
+            # 3. UPDATE CONTACT WITH TELEGRAM ID - outside the atomic call so a
+            # failed contact update never undoes the registration
+            if has_contact and not self.update_contact_telegram_id(contact_id, telegram_id):
+                logger.warning(f"Registered {telegram_id} without updating contact {contact_id}")
             
-            # 3. UPDATE CONTACT WITH TELEGRAM ID (if contact exists and valid)
-            if contact_id and re.match(r'^[a-zA-Z0-9]{15,18}$', contact_id):
-                self.update_contact_telegram_id(contact_id, telegram_id)
+            # Seed the cache so the next message skips the lookup
+            channel_user_cache.set(str(telegram_id), {
+                'Id': channel_user_id,
+                'Name': name,
+                'Telegram_Chat_ID__c': str(telegram_id),
+                'Contact__c': channel_user_data.get('Contact__c')
+            })
             
             return {
                 'channelUserId': channel_user_id,
@@ -854,17 +1730,14 @@ class TelegramBotManager:
             if not access_token:
                 return False
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Channel_User__c/{channel_user_id}"
+            url = f"{SF_CHANNEL_USER_URL}/{channel_user_id}"
             data = {
                 'Contact__c': contact_id
             }
             
-            response = requests.patch(url, headers=headers, json=data, timeout=30)
+            response = salesforce_request('PATCH', url, headers=headers, data=orjson.dumps(data))
             
             if response.status_code == 204:
                 logger.info(f"Linked Channel_User__c {channel_user_id} to Contact {contact_id}")
@@ -884,17 +1757,14 @@ class TelegramBotManager:
             if not access_token:
                 return False
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/sobjects/Contact/{contact_id}"
+            url = f"{SF_CONTACT_URL}/{contact_id}"
             data = {
                 'Telegram_Chat_ID__c': str(telegram_id)
             }
             
-            response = requests.patch(url, headers=headers, json=data, timeout=30)
+            response = salesforce_request('PATCH', url, headers=headers, data=orjson.dumps(data))
             
             if response.status_code == 204:
                 logger.info(f"Updated contact {contact_id} with Telegram ID {telegram_id}")
@@ -913,7 +1783,7 @@ class TelegramBotManager:
             payload = {
                 'channelType': 'Telegram',
                 'chatId': str(chat_id),
-                'messageId': f"TG_SESSION_{int(time.time())}",
+                'messageId': new_message_id('TG_SESSION', chat_id),
                 'firstName': first_name,
                 'lastName': last_name,
                 'isSessionStart': True,
@@ -934,95 +1804,111 @@ class TelegramBotManager:
             return False
     
     def get_queue_position(self, conversation_id):
-        """Get queue position for a conversation - FIXED VERSION"""
+        """Get queue position for a conversation from a short-lived snapshot of the queue"""
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+            headers = self._sf_headers(access_token)
             
-            # First, get the latest waiting session for this conversation
-            session_query = f"""
-            SELECT Id, CreatedDate 
-            FROM Chat_Session__c 
-            WHERE Support_Conversation__c = '{conversation_id}'
-            AND Status__c = 'Waiting'
-            ORDER BY CreatedDate DESC
-            LIMIT 1
-            """
-            encoded_session_query = requests.utils.quote(session_query)
-            session_url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_session_query}"
-            
-            session_response = requests.get(session_url, headers=headers, timeout=30)
-            
-            if session_response.status_code != 200:
+            sanitized_id = sanitize_salesforce_id(conversation_id)
+            if not sanitized_id:
                 return None
             
-            session_data = session_response.json()
-            if session_data['totalSize'] == 0:
+            snapshot = self._get_waiting_sessions(headers)
+            if snapshot is None:
                 return None
             
-            latest_session_id = session_data['records'][0]['Id']
-            
-            # Now get all waiting sessions and find our position
-            all_sessions_query = f"""
-            SELECT Id, CreatedDate 
-            FROM Chat_Session__c 
-            WHERE Owner.Name = 'New Telegram Messages'
-            AND Status__c = 'Waiting'
-            ORDER BY CreatedDate ASC
-            """
-            encoded_all_query = requests.utils.quote(all_sessions_query)
-            all_url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_all_query}"
+            position = self._position_in_snapshot(snapshot, sanitized_id)
+            if position is None:
+                # Session may have been queued after the snapshot was taken
+                snapshot = self._get_waiting_sessions(headers, refresh=True)
+                if snapshot is None:
+                    return None
+                position = self._position_in_snapshot(snapshot, sanitized_id)
             
-            all_response = requests.get(all_url, headers=headers, timeout=30)
+            if position is None and len(snapshot) >= QUEUE_SNAPSHOT_LIMIT:
+                # Queue is longer than the snapshot - count server-side instead
+                return self._count_queue_position(headers, sanitized_id)
             
-            if all_response.status_code == 200:
-                all_data = all_response.json()
-                records = all_data.get('records', [])
-                
-                # Find position of our session
-                for i, record in enumerate(records):
-                    if record.get('Id') == latest_session_id:
-                        return i + 1  # Position in queue (1-based)
-            
-            return None
+            return position
             
         except Exception as e:
             logger.error(f"Error getting queue position: {e}")
             return None
     
+    def _get_waiting_sessions(self, headers, refresh=False):
+        """Get waiting sessions in queue order, shared by all callers for QUEUE_SNAPSHOT_TTL"""
+        if not refresh:
+            snapshot = queue_snapshot_cache.get(QUEUE_OWNER_NAME)
+            if snapshot is not None:
+                return snapshot
+        
+        response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': WAITING_SESSIONS_QUERY})
+        if response.status_code != 200:
+            return None
+        
+        snapshot = tuple(
+            record['Support_Conversation__c']
+            for record in orjson.loads(response.content)['records']
+        )
+        queue_snapshot_cache.set(QUEUE_OWNER_NAME, snapshot)
+        return snapshot
+    
+    def _position_in_snapshot(self, snapshot, conversation_id):
+        """1-based position of the conversation's latest waiting session, or None"""
+        for index in range(len(snapshot) - 1, -1, -1):
+            if snapshot[index] == conversation_id:
+                return index + 1
+        return None
+    
+    def _count_queue_position(self, headers, sanitized_id):
+        """Get queue position for a conversation using a server-side COUNT()"""
+        # First, get the latest waiting session for this conversation
+        session_query = LATEST_WAITING_SESSION_QUERY.format(conversation_id=sanitized_id)
+        session_response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': session_query})
+        
+        if session_response.status_code != 200:
+            return None
+        
+        session_data = orjson.loads(session_response.content)
+        if session_data['totalSize'] == 0:
+            return None
+        
+        # SOQL datetime literals are unquoted and have no milliseconds
+        created_date = datetime.strptime(
+            session_data['records'][0]['CreatedDate'], '%Y-%m-%dT%H:%M:%S.%f%z'
+        )
+        created_literal = created_date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        
+        # Count sessions queued ahead of ours - only an integer comes back
+        count_query = QUEUE_AHEAD_COUNT_QUERY.format(created_before=created_literal)
+        count_response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': count_query})
+        
+        if count_response.status_code == 200:
+            return orjson.loads(count_response.content)['totalSize'] + 1  # Position in queue (1-based)
+        
+        return None
+    
     def get_session_details(self, session_id):
         """Get detailed session information"""
+        session_id = sanitize_salesforce_id(session_id)
+        if not session_id:
+            return None
+        
         try:
             access_token = self.sf_auth.get_access_token()
             if not access_token:
                 return None
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            query = f"""
-            SELECT Id, Name, Status__c, OwnerId, Owner.Name, 
-                   Assigned_Agent__c, Assigned_Agent__r.Name,
-                   Created_Date__c, Last_Message_Time__c,
-                   Support_Conversation__c
-            FROM Chat_Session__c 
-            WHERE Id = '{session_id}'
-            """
-            encoded_query = requests.utils.quote(query)
-            url = f"{SF_INSTANCE_URL}/services/data/v58.0/query?q={encoded_query}"
+            headers = self._sf_headers(access_token)
             
-            response = requests.get(url, headers=headers, timeout=30)
+            query = SESSION_DETAILS_QUERY.format(session_id=session_id)
+            response = salesforce_request('GET', SF_QUERY_URL, headers=headers, params={'q': query})
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 if data['totalSize'] > 0:
                     return data['records'][0]
             return None
@@ -1031,8 +1917,155 @@ class TelegramBotManager:
             logger.error(f"Error getting session details: {e}")
             return None
 
-# Initialize bot manager
-bot_manager = TelegramBotManager()
+# Initialize bot manager
+bot_manager = TelegramBotManager()
+
+# ============================================
+# STATIC KEYBOARDS (serialized once at import)
+# ============================================
+MAIN_MENU_MARKUP_JSON = orjson.dumps({
+    "inline_keyboard": [
+        [{"text": "👥 Contact Customer Support", "callback_data": "contact_support"}],
+        [{"text": "📋 Track your Case", "callback_data": "track_case"}],
+        [{"text": "🏠 Main Menu", "callback_data": "main_menu"}]
+    ],
+    "resize_keyboard": True,
+    "one_time_keyboard": False
+}).decode()
+
+REGISTRATION_MARKUP_JSON = orjson.dumps({
+    "inline_keyboard": [
+        [{"text": "📱 Register with Phone Number", "callback_data": "register_phone"}]
+    ]
+}).decode()
+
+# ============================================
+# MESSAGE TEMPLATES
+# ============================================
+# Static replies built once; templates take their dynamic parts via .format()
+MAIN_MENU_MSG = """
+{welcome}
+
+*Choose an option:*
+
+👥 *Contact Customer Support* - Connect with our support team
+📋 *Track your Case* - Check status of existing cases
+🏠 *Main Menu* - Refresh this menu
+"""
+
+# The menu only has two shapes, so both are resolved once here
+MAIN_MENU_DEFAULT_TEXT = MAIN_MENU_MSG.format(welcome="👋 *Welcome to Bank of Abyssinia Support!*")
+MAIN_MENU_NAMED_MSG = MAIN_MENU_MSG.format(welcome="👋 *Welcome back, {name}!*")
+
+CONVERSATION_NOT_FOUND_MSG = """
+❌ *Sorry, we couldn't find your conversation.*
+
+Please try again or contact support through other channels.
+"""
+
+ACTIVE_SESSION_MSG = """
+✅ *You have an active support session!*
+
+You're currently connected with an agent. Please continue your conversation.
+"""
+
+QUEUE_POSITION_MSG = """
+⏳ *You're #{position} in the queue.*
+
+Please wait for an agent to join. You can describe your issue now.
+"""
+
+IN_QUEUE_MSG = """
+⏳ *Your support request is in the queue.*
+
+Please wait for an agent to join. You can describe your issue now.
+"""
+
+SESSION_CREATE_FAILED_MSG = """
+❌ *Sorry, we couldn't create a support session.*
+
+Please try again in a few moments.
+"""
+
+SESSION_NOT_RETRIEVED_MSG = """
+❌ *Session was created but we couldn't retrieve it.*
+
+Please wait a moment and send your message again.
+"""
+
+SESSION_CREATED_POSITION_MSG = """
+✅ *Support session created!*
+
+You are now *#{position} in the queue*. An agent will be with you shortly.
+"""
+
+SESSION_CREATED_MSG = """
+✅ *Support session created!*
+
+You are now in the queue. An agent will be with you shortly.
+"""
+
+TRACK_CASE_MSG = """
+🔍 *Case Tracking*
+
+This feature is coming soon! We're working on allowing you to track your support cases directly here.
+
+For now, please contact customer support for case updates.
+"""
+
+REGISTER_PHONE_PROMPT_MSG = """
+👋 *Welcome to Bank of Abyssinia Support!*
+
+To get started, please share your *phone number*:
+
+Example: *0912121212* or *+251912121212*
+"""
+
+REGISTER_PROMPT_MSG = """
+👋 *Welcome to Bank of Abyssinia Support!*
+
+To use our support services, please register by clicking the button below.
+"""
+
+NAME_REQUEST_MSG = """
+✅ *Phone number received!*
+
+Now, please enter your *first and last name*:
+
+Example: *John Smith*
+"""
+
+INVALID_PHONE_MSG = """
+📱 *Please enter a valid Ethiopian phone number:*
+
+Example: *0912121212* or *+251912121212*
+"""
+
+FULL_NAME_REQUIRED_MSG = """
+📝 *Please enter both first and last name:*
+
+Example: *John Smith*
+"""
+
+REGISTERED_WELCOME_BACK_MSG = """
+✅ *Welcome back, {name}!*
+
+You're now registered in our support system.
+"""
+
+REGISTRATION_SUCCESS_MSG = """
+✅ *Registration Successful!*
+
+Welcome *{first_name} {last_name}*, you're now connected to our support system.
+"""
+
+DELIVERED_MSG = "✅ *Message delivered.*"
+DELIVERED_WAITING_MSG = "✅ *Message delivered. Waiting for agent to respond.*"
+SEND_FAILED_MSG = "❌ *Failed to send message. Please try again.*"
+DELIVERED_POSITION_MSG = "✅ *Message delivered. You are #{position} in queue.*"
+DELIVERED_QUEUED_MSG = "✅ *Message delivered. You are in the queue.*"
+SUPPORT_ERROR_MSG = "❌ *Sorry, there was an error connecting to support. Please try again.*"
+ACCOUNT_CREATE_FAILED_MSG = "❌ *Sorry, there was an error creating your account. Please try again.*"
 
 # ============================================
 # UTILITY FUNCTIONS WITH SECURITY
@@ -1050,58 +2083,35 @@ def is_menu_command(text):
     if not text:
         return False
     
-    menu_commands = ['/start', 'hi', 'hello', 'hey', 'menu', 'help']
-    return text.strip().lower() in menu_commands
+    return text.strip().lower() in MENU_COMMANDS
 
 def show_main_menu(chat_id, user_name=None):
     """Show main menu with inline keyboard buttons - NO CONTINUE OPTION"""
-    
-    welcome_text = "👋 *Welcome to Bank of Abyssinia Support!*"
+    menu_text = MAIN_MENU_DEFAULT_TEXT
     if user_name:
-        safe_name = re.sub(r'[^\w\s\-]', '', user_name)[:30]
-        welcome_text = f"👋 *Welcome back, {safe_name}!*"
-    
-    keyboard = [
-        [{"text": "👥 Contact Customer Support", "callback_data": "contact_support"}],
-        [{"text": "📋 Track your Case", "callback_data": "track_case"}],
-        [{"text": "🏠 Main Menu", "callback_data": "main_menu"}]
-    ]
-    
-    menu_text = f"""
-{welcome_text}
-
-*Choose an option:*
-
-👥 *Contact Customer Support* - Connect with our support team
-📋 *Track your Case* - Check status of existing cases
-🏠 *Main Menu* - Refresh this menu
-    """
-    
-    reply_markup = {
-        "inline_keyboard": keyboard,
-        "resize_keyboard": True,
-        "one_time_keyboard": False
-    }
+        safe_name = NAME_UNSAFE_PATTERN.sub('', user_name)[:30]
+        if safe_name:
+            menu_text = MAIN_MENU_NAMED_MSG.format(name=safe_name)
     
-    return bot_manager.send_message(chat_id, menu_text, reply_markup=reply_markup, parse_mode='Markdown')
+    return bot_manager.send_message(chat_id, menu_text, reply_markup=MAIN_MENU_MARKUP_JSON, parse_mode='Markdown')
 
 def handle_contact_support(chat_id, channel_user_id, conversation_id, user_data):
     """Handle Contact Customer Support option - WITH QUEUE POSITION"""
     try:
         # Show typing indicator
-        bot_manager.send_typing_action(chat_id)
+        show_typing(chat_id)
         
         if not conversation_id:
-            error_text = """
-❌ *Sorry, we couldn't find your conversation.*
-
-Please try again or contact support through other channels.
-            """
+            error_text = CONVERSATION_NOT_FOUND_MSG
             bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
             return False, None
         
         # Check for existing sessions
-        active_sessions = bot_manager.get_active_sessions(conversation_id)
+        active_sessions = get_sessions(conversation_id)
+        if active_sessions is None:
+            # Unknown, not empty - creating one now could duplicate a session
+            bot_manager.send_message(chat_id, SUPPORT_ERROR_MSG, parse_mode='Markdown')
+            return False, None
         
         if active_sessions:
             # Session exists (waiting or active), return it
@@ -1110,35 +2120,24 @@ Please try again or contact support through other channels.
             session_status = session.get('Status__c', 'Waiting')
             
             # Update user session state
-            user_session_state[str(chat_id)] = {
-                'in_session': True,
-                'conversation_id': conversation_id,
-                'session_id': session_id,
-                'session_status': session_status
-            }
+            set_state(
+                str(chat_id),
+                in_session=True,
+                conversation_id=conversation_id,
+                session_id=session_id,
+                session_status=session_status
+            )
             
             # Send appropriate message based on status
             if session_status == 'Active':
-                response_text = """
-✅ *You have an active support session!*
-
-You're currently connected with an agent. Please continue your conversation.
-                """
+                response_text = ACTIVE_SESSION_MSG
             else:
                 # For waiting sessions, show queue position
-                queue_position = bot_manager.get_queue_position(conversation_id)
+                queue_position = get_queue_position(conversation_id)
                 if queue_position:
-                    response_text = f"""
-⏳ *You're #{queue_position} in the queue.*
-
-Please wait for an agent to join. You can describe your issue now.
-                    """
+                    response_text = QUEUE_POSITION_MSG.format(position=queue_position)
                 else:
-                    response_text = """
-⏳ *Your support request is in the queue.*
-
-Please wait for an agent to join. You can describe your issue now.
-                    """
+                    response_text = IN_QUEUE_MSG
             
             bot_manager.send_message(chat_id, response_text, parse_mode='Markdown')
             return True, session_id
@@ -1153,25 +2152,20 @@ Please wait for an agent to join. You can describe your issue now.
             )
             
             if not success:
-                error_text = """
-❌ *Sorry, we couldn't create a support session.*
-
-Please try again in a few moments.
-                """
+                error_text = SESSION_CREATE_FAILED_MSG
                 bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
                 return False, None
             
-            # Wait a moment for session to be created
-            time.sleep(2)
-            
-            # Get the newly created session
-            active_sessions = bot_manager.get_active_sessions(conversation_id)
-            if not active_sessions:
-                error_text = """
-❌ *Session was created but we couldn't retrieve it.*
+            # Poll for the newly created session with backoff instead of a fixed wait
+            active_sessions = []
+            for delay in SESSION_POLL_DELAYS:
+                time.sleep(delay)
+                active_sessions = get_sessions(conversation_id, refresh=True)
+                if active_sessions:
+                    break
 
-Please wait a moment and send your message again.
-                """
+            if not active_sessions:
+                error_text = SESSION_NOT_RETRIEVED_MSG
                 bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
                 return False, None
             
@@ -1179,47 +2173,33 @@ Please wait a moment and send your message again.
             session_id = session.get('Id')
             
             # Update user session state
-            user_session_state[str(chat_id)] = {
-                'in_session': True,
-                'conversation_id': conversation_id,
-                'session_id': session_id,
-                'session_status': 'Waiting'
-            }
+            set_state(
+                str(chat_id),
+                in_session=True,
+                conversation_id=conversation_id,
+                session_id=session_id,
+                session_status='Waiting'
+            )
             
             # Get queue position for new session
-            queue_position = bot_manager.get_queue_position(conversation_id)
+            queue_position = get_queue_position(conversation_id, refresh=True)
             
             if queue_position:
-                response_text = f"""
-✅ *Support session created!*
-
-You are now *#{queue_position} in the queue*. An agent will be with you shortly.
-                """
+                response_text = SESSION_CREATED_POSITION_MSG.format(position=queue_position)
             else:
-                response_text = """
-✅ *Support session created!*
-
-You are now in the queue. An agent will be with you shortly.
-                """
+                response_text = SESSION_CREATED_MSG
             
             bot_manager.send_message(chat_id, response_text, parse_mode='Markdown')
             return True, session_id
         
     except Exception as e:
         logger.error(f"Error handling contact support: {e}")
-        error_text = "❌ *Sorry, there was an error connecting to support. Please try again.*"
-        bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
+        bot_manager.send_message(chat_id, SUPPORT_ERROR_MSG, parse_mode='Markdown')
         return False, None
 
 def handle_track_case(chat_id):
     """Handle Track your Case option"""
-    response_text = """
-🔍 *Case Tracking*
-
-This feature is coming soon! We're working on allowing you to track your support cases directly here.
-
-For now, please contact customer support for case updates.
-    """
+    response_text = TRACK_CASE_MSG
     return bot_manager.send_message(chat_id, response_text, parse_mode='Markdown')
 
 def send_message_confirmation(chat_id, success, is_session_start=False, queue_position=None):
@@ -1229,40 +2209,201 @@ def send_message_confirmation(chat_id, success, is_session_start=False, queue_po
             if queue_position:
                 return bot_manager.send_message(
                     chat_id,
-                    f"✅ *Message delivered. You are #{queue_position} in queue.*",
+                    DELIVERED_POSITION_MSG.format(position=queue_position),
                     parse_mode='Markdown'
                 )
             else:
                 return bot_manager.send_message(
                     chat_id,
-                    "✅ *Message delivered. You are in the queue.*",
+                    DELIVERED_QUEUED_MSG,
                     parse_mode='Markdown'
                 )
         else:
             return bot_manager.send_message(
                 chat_id,
-                "❌ *Failed to send message. Please try again.*",
+                SEND_FAILED_MSG,
                 parse_mode='Markdown'
             )
     else:
         if success:
             return bot_manager.send_message(
                 chat_id,
-                "✅ *Message delivered.*",
+                DELIVERED_MSG,
                 parse_mode='Markdown'
             )
         else:
             return bot_manager.send_message(
                 chat_id,
-                "❌ *Failed to send message. Please try again.*",
+                SEND_FAILED_MSG,
                 parse_mode='Markdown'
             )
 
-# In-memory storage for user session state
-user_session_state = {}
+# User session state, expired after inactivity. Kept in Redis when REDIS_URL
+# is set so every worker sees the same state; otherwise bounded in memory.
+if redis_client is not None:
+    user_session_state = RedisStateStore(redis_client, ttl=SESSION_STATE_TTL, fallback_maxsize=SESSION_STATE_MAX_ENTRIES)
+else:
+    user_session_state = TTLCache(maxsize=SESSION_STATE_MAX_ENTRIES, ttl=SESSION_STATE_TTL)
 # In-memory storage for registration flow state
 registration_flow = {}
 
+# Single-worker executors; a chat's updates always go to the same one
+update_executors = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'update-worker-{i}')
+    for i in range(UPDATE_WORKER_SHARDS)
+]
+
+# Update IDs already accepted, so a webhook Telegram redelivers after a slow
+# or failed ack is not processed twice. Kept in Redis when available so a
+# redelivery landing on another worker is caught too.
+seen_updates = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=SEEN_UPDATE_TTL)
+
+def claim_update(update_id):
+    """Record update_id as handled; False if it was seen before"""
+    if redis_client is not None:
+        try:
+            return bool(redis_client.set(f"tg:update:{update_id}", 1, nx=True, ex=SEEN_UPDATE_TTL))
+        except redis.RedisError as e:
+            logger.warning(f"Update dedupe via Redis failed, using local cache: {e}")
+    return seen_updates.add(update_id)
+
+# Updates queued or running on the shards
+update_backlog = 0
+update_backlog_lock = threading.Lock()
+
+def update_backlog_full():
+    """True when the shards are too far behind to accept another update"""
+    if update_backlog < UPDATE_BACKLOG_MAX:
+        return False
+    logger.warning(f"Update backlog at {update_backlog} (limit {UPDATE_BACKLOG_MAX}), asking Telegram to retry")
+    return True
+
+# Speculative lookups started while the user is still typing their next reply
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+# Typing indicators, sent beside the update instead of ahead of it; a
+# separate pool so a slow Telegram call never holds up real work
+chat_action_executor = ThreadPoolExecutor(max_workers=CHAT_ACTION_WORKERS, thread_name_prefix='chat-action')
+
+def show_typing(chat_id):
+    """Send the typing indicator without waiting for Telegram's reply"""
+    chat_action_executor.submit(bot_manager.send_typing_action, chat_id)
+
+def prefetch_contact_by_phone(clean_phone):
+    """Start the registration contact lookup now; the name step picks up the
+    cached result (or joins the in-flight query) instead of waiting on it"""
+    prefetch_executor.submit(bot_manager.find_contact_by_phone, clean_phone)
+
+def shutdown_update_executors():
+    """Let queued updates finish before the worker exits"""
+    for executor in update_executors:
+        executor.shutdown(wait=True)
+
+atexit.register(shutdown_update_executors)
+
+def _run_update_handler(handler, *args):
+    """Run an update handler on a worker thread, logging anything it raises"""
+    global update_backlog
+    bot_manager.coalescer.start()
+    try:
+        handler(*args)
+    except Exception as e:
+        logger.error(f"Background update handler error: {e}")
+    finally:
+        bot_manager.coalescer.flush()
+        with update_backlog_lock:
+            update_backlog -= 1
+
+def dispatch_update(chat_id, handler, *args):
+    """Queue an update for background processing, preserving per-chat order"""
+    global update_backlog
+    executor = update_executors[int(chat_id) % UPDATE_WORKER_SHARDS]
+    # Counted before submit so the handler's decrement can't run first
+    with update_backlog_lock:
+        update_backlog += 1
+    try:
+        executor.submit(_run_update_handler, handler, *args)
+    except Exception:
+        # Never queued (e.g. executor shut down), so the handler won't decrement
+        with update_backlog_lock:
+            update_backlog -= 1
+        raise
+
+def get_state(chat_id_str):
+    """Get a copy of the session state for a chat ({} if none)"""
+    return dict(user_session_state.get(chat_id_str) or {})
+
+def set_state(chat_id_str, **fields):
+    """Replace the session state for a chat"""
+    user_session_state.set(chat_id_str, fields)
+
+def update_state(chat_id_str, **fields):
+    """Merge fields into an existing session state; returns the new state or None"""
+    with user_session_state.lock:
+        state = user_session_state.get(chat_id_str)
+        if state is None:
+            return None
+        state = {**state, **fields}
+        user_session_state.set(chat_id_str, state)
+        return state
+
+def clear_state(chat_id_str):
+    """Remove the session state for a chat; returns True if there was one"""
+    return user_session_state.pop(chat_id_str) is not None
+
+def get_user_context(chat_id_str):
+    """Get (channel_user, conversation) for a chat, served from cache when possible.
+    
+    On a miss the active sessions come back in the same Salesforce call and
+    seed the sessions cache, so get_sessions() right after is free.
+    """
+    cached = user_context_cache.get(chat_id_str)
+    if cached:
+        return cached
+    
+    context = bot_manager.get_full_user_context(chat_id_str)
+    if context is None:
+        return None, None
+    
+    channel_user, conversation = context['channel_user'], context['conversation']
+    if channel_user and conversation:
+        user_context_cache.set(chat_id_str, (channel_user, conversation))
+        if context['active_sessions'] is not None:
+            active_sessions_cache.set(conversation['Id'], context['active_sessions'])
+    return channel_user, conversation
+
+def get_sessions(conversation_id, refresh=False):
+    """Get active/waiting sessions for a conversation, served from a short-lived cache"""
+    if not refresh:
+        cached = active_sessions_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+    
+    sessions = bot_manager.get_active_sessions(conversation_id)
+    # A failed lookup (None) is not cached - it must not read as "no session"
+    if sessions is not None:
+        active_sessions_cache.set(conversation_id, sessions)
+    return sessions
+
+def get_queue_position(conversation_id, refresh=False):
+    """Get queue position for a conversation, served from a short-lived cache"""
+    if not refresh:
+        cached = queue_position_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+    
+    position = bot_manager.get_queue_position(conversation_id)
+    if position is not None:
+        queue_position_cache.set(conversation_id, position)
+    return position
+
+def invalidate_user_context(chat_id_str, conversation_id=None):
+    """Drop cached lookups for a chat after its session state changes"""
+    user_context_cache.pop(chat_id_str)
+    if conversation_id:
+        active_sessions_cache.pop(conversation_id)
+        queue_position_cache.pop(conversation_id)
+
 #///////////////////////////////
 def handle_callback_query(callback_query):
     """Handle inline keyboard button presses - UPDATED VERSION"""
@@ -1277,20 +2418,18 @@ def handle_callback_query(callback_query):
         # Get user data from callback query
         user_data = callback_query.get('from', {})
         
-        logger.info(f"Callback query from {chat_id}: {callback_data}")
+        logger.info("Callback query from %s: %s", chat_id, callback_data)
         
         # Remove the buttons from the message that was clicked
         bot_manager.edit_message_reply_markup(chat_id, message_id, reply_markup=None)
         
-        # Check if Channel_User__c exists
-        channel_user = bot_manager.check_existing_channel_user(str(chat_id))
+        # Check if Channel_User__c exists (conversation comes back with it)
+        channel_user, conversation = get_user_context(str(chat_id))
         
         if not channel_user:
             # Handle registration for new users
             return handle_new_user_registration_callback(chat_id, callback_data, user_data)
         
-        # Get conversation
-        conversation = bot_manager.get_active_support_conversation(channel_user['Id'])
         if not conversation:
             error_text = "❌ Sorry, we couldn't find your conversation."
             bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
@@ -1307,12 +2446,13 @@ def handle_callback_query(callback_query):
                 user_data
             )
             if success and session_id:
-                user_session_state[str(chat_id)] = {
-                    'in_session': True,
-                    'conversation_id': conversation_id,
-                    'session_id': session_id,
-                    'session_status': 'Waiting'
-                }
+                set_state(
+                    str(chat_id),
+                    in_session=True,
+                    conversation_id=conversation_id,
+                    session_id=session_id,
+                    session_status='Waiting'
+                )
             return success
             
         elif callback_data == 'track_case':
@@ -1325,42 +2465,34 @@ def handle_callback_query(callback_query):
         elif callback_data == 'continue_session':
             # REMOVED - We don't have "Continue Support Session" anymore
             # Instead, check if there's a session and forward to it, or show menu
-            active_sessions = bot_manager.get_active_sessions(conversation_id)
+            active_sessions = get_sessions(conversation_id)
+            if active_sessions is None:
+                bot_manager.send_message(chat_id, SUPPORT_ERROR_MSG, parse_mode='Markdown')
+                return False
             if active_sessions:
                 # There's a session, show appropriate message
                 session = active_sessions[0]
                 session_status = session.get('Status__c', 'Waiting')
                 
                 if session_status == 'Active':
-                    response_text = """
-✅ *You have an active support session!*
-
-You're currently connected with an agent. Please continue your conversation.
-                    """
+                    response_text = ACTIVE_SESSION_MSG
                 else:
-                    queue_position = bot_manager.get_queue_position(conversation_id)
+                    queue_position = get_queue_position(conversation_id)
                     if queue_position:
-                        response_text = f"""
-⏳ *You're #{queue_position} in the queue.*
-
-Please wait for an agent to join. You can describe your issue now.
-                        """
+                        response_text = QUEUE_POSITION_MSG.format(position=queue_position)
                     else:
-                        response_text = """
-⏳ *Your support request is in the queue.*
-
-Please wait for an agent to join. You can describe your issue now.
-                        """
+                        response_text = IN_QUEUE_MSG
                 
                 bot_manager.send_message(chat_id, response_text, parse_mode='Markdown')
                 
                 # Update session state
-                user_session_state[str(chat_id)] = {
-                    'in_session': True,
-                    'conversation_id': conversation_id,
-                    'session_id': session.get('Id'),
-                    'session_status': session_status
-                }
+                set_state(
+                    str(chat_id),
+                    in_session=True,
+                    conversation_id=conversation_id,
+                    session_id=session.get('Id'),
+                    session_status=session_status
+                )
             else:
                 # No session, show main menu
                 user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
@@ -1373,12 +2505,13 @@ Please wait for an agent to join. You can describe your issue now.
             
         elif callback_data == 'confirm_new_session':
             # User confirmed they want new session
-            user_session_state[str(chat_id)] = {}
+            clear_state(str(chat_id))
+            invalidate_user_context(str(chat_id), conversation_id)
             return handle_contact_support(chat_id, channel_user['Id'], conversation_id, user_data)
             
         elif callback_data == 'cancel_new_session':
             # User cancelled new session request
-            user_session_state[str(chat_id)] = {}
+            clear_state(str(chat_id))
             # Show main menu
             user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
             return show_main_menu(chat_id, user_name)
@@ -1400,7 +2533,7 @@ def handle_new_user_registration_callback(chat_id, callback_data, user_data):
         if channel_user:
             # User is already registered, show main menu
             user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
-            return show_main_menu(chat_id, user_name, has_active_session=False)
+            return show_main_menu(chat_id, user_name)
         
         # Check registration flow state
         if chat_id_str in registration_flow:
@@ -1420,13 +2553,7 @@ def handle_new_user_registration_callback(chat_id, callback_data, user_data):
         registration_flow[chat_id_str] = {'step': 'phone_requested'}
         
         # Send ONLY ONE message asking for phone number
-        welcome_text = """
-👋 *Welcome to Bank of Abyssinia Support!*
-
-To get started, please share your *phone number*:
-
-Example: *0912121212* or *+251912121212*
-        """
+        welcome_text = REGISTER_PHONE_PROMPT_MSG
         return bot_manager.send_message(chat_id, welcome_text, parse_mode='Markdown')
     
     return True
@@ -1444,20 +2571,17 @@ def process_incoming_message(chat_id, message_text, user_data):
             logger.warning(f"Invalid chat ID format: {chat_id}")
             return False
         
-        # Show typing indicator
-        bot_manager.send_typing_action(chat_id)
-        
         chat_id_str = safe_chat_id
         message_lower = safe_message.strip().lower()
         
-        logger.info(f"Processing message from {chat_id}: {safe_message[:50]}...")
+        logger.info("Processing message from %s: %.50s...", chat_id, safe_message)
         
-        # STEP 1: Check if Channel_User__c exists FIRST
-        channel_user = bot_manager.check_existing_channel_user(chat_id_str)
+        # STEP 1: Check if Channel_User__c exists FIRST (with its active conversation)
+        channel_user, conversation = get_user_context(chat_id_str)
 
         if channel_user:
             # ✅ User IS REGISTERED - handle as existing user
-            return handle_existing_user(chat_id, safe_message, user_data, channel_user)
+            return handle_existing_user(chat_id, safe_message, user_data, channel_user, conversation)
         else:
             # ❌ User is NOT REGISTERED - handle registration flow
             return handle_unregistered_user(chat_id, safe_message, user_data, chat_id_str, message_lower)
@@ -1471,28 +2595,13 @@ def process_incoming_message(chat_id, message_text, user_data):
         )
         return False
 
-#################################################
-#New Method
-def forward_to_existing_session(chat_id, message_text, user_data, chat_id_str, conversation_id, session):
-    """Forward message to existing session (waiting or active)"""
-    session_id = session.get('Id')
-    session_status = session.get('Status__c', 'Waiting')
-    
-    # Update user state with current session info
-    user_session_state[chat_id_str] = {
-        'in_session': True,
-        'conversation_id': conversation_id,
-        'session_id': session_id,
-        'session_status': session_status
-    }
-    
-    logger.info(f"Forwarding message to session {session_id} (status: {session_status})")
-    
-    payload = {
+def build_forward_payload(chat_id_str, message_text, user_data, conversation_id, session_id):
+    """Build the webhook payload for forwarding a user message to a session"""
+    return {
         'channelType': 'Telegram',
         'chatId': chat_id_str,
         'message': message_text,
-        'messageId': f"TG_{int(time.time())}",
+        'messageId': new_message_id('TG', chat_id_str),
         'firstName': user_data.get('first_name', ''),
         'lastName': user_data.get('last_name', ''),
         'username': user_data.get('username', ''),
@@ -1501,6 +2610,29 @@ def forward_to_existing_session(chat_id, message_text, user_data, chat_id_str, c
         'sessionId': session_id,
         'isSessionStart': False
     }
+
+#################################################
+#New Method
+def forward_to_existing_session(chat_id, message_text, user_data, chat_id_str, conversation_id, session):
+    """Forward message to existing session (waiting or active)"""
+    session_id = session.get('Id')
+    session_status = session.get('Status__c', 'Waiting')
+    
+    # Update user state with current session info
+    set_state(
+        chat_id_str,
+        in_session=True,
+        conversation_id=conversation_id,
+        session_id=session_id,
+        session_status=session_status
+    )
+    
+    logger.info("Forwarding message to session %s (status: %s)", session_id, session_status)
+    
+    # Only the Salesforce round trip is slow enough to warrant a typing indicator
+    show_typing(chat_id)
+    
+    payload = build_forward_payload(chat_id_str, message_text, user_data, conversation_id, session_id)
     
     success = bot_manager.forward_to_salesforce(payload)
     
@@ -1509,37 +2641,36 @@ def forward_to_existing_session(chat_id, message_text, user_data, chat_id_str, c
         if session_status == 'Waiting':
             bot_manager.send_message(
                 chat_id,
-                "✅ *Message delivered. Waiting for agent to respond.*",
+                DELIVERED_WAITING_MSG,
                 parse_mode='Markdown'
             )
         else:  # Active session
             bot_manager.send_message(
                 chat_id,
-                "✅ *Message delivered.*",
+                DELIVERED_MSG,
                 parse_mode='Markdown'
             )
     else:
         bot_manager.send_message(
             chat_id,
-            "❌ *Failed to send message. Please try again.*",
+            SEND_FAILED_MSG,
             parse_mode='Markdown'
         )
     
     return success
 ################################################
-def handle_existing_user(chat_id, message_text, user_data, channel_user):
+def handle_existing_user(chat_id, message_text, user_data, channel_user, conversation):
     """Handle messages from existing (registered) users - SIMPLIFIED"""
     chat_id_str = str(chat_id)
     message_lower = message_text.strip().lower()
     
-    logger.info(f"Existing Channel User found: {channel_user['Id']}")
+    logger.info("Existing Channel User found: %s", channel_user['Id'])
     
     # Clear any leftover registration state
     if chat_id_str in registration_flow:
         registration_flow.pop(chat_id_str, None)
     
-    # Get conversation for this user
-    conversation = bot_manager.get_active_support_conversation(channel_user['Id'])
+    # Conversation for this user was fetched together with the channel user
     if not conversation:
         logger.error(f"No active conversation found for channel user {channel_user['Id']}")
         error_text = "❌ Sorry, we couldn't find your conversation. Please start a new session."
@@ -1551,11 +2682,11 @@ def handle_existing_user(chat_id, message_text, user_data, channel_user):
     conversation_id = conversation['Id']
     
     # Check for ANY sessions (waiting or active)
-    any_sessions = bot_manager.get_active_sessions(conversation_id)
-    has_any_session = len(any_sessions) > 0
+    any_sessions = get_sessions(conversation_id)
+    has_any_session = bool(any_sessions)
     
     # Check user's current session state
-    user_state = user_session_state.get(chat_id_str, {})
+    user_state = get_state(chat_id_str)
     
     # Handle menu commands (always show menu for these)
     if is_menu_command(message_text):
@@ -1563,14 +2694,14 @@ def handle_existing_user(chat_id, message_text, user_data, channel_user):
         return show_main_menu(chat_id, user_name)
     
     # Handle text commands for backward compatibility
-    if message_lower in ['contact', 'support', 'contact support', 'customer support']:
+    if message_lower in SUPPORT_COMMANDS:
         user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
         return show_main_menu(chat_id, user_name)
     
-    elif message_lower in ['track', 'track case', 'case', 'my case']:
+    elif message_lower in TRACK_COMMANDS:
         return handle_track_case(chat_id)
     
-    elif message_lower in ['new', 'new support', 'new session']:
+    elif message_lower in NEW_SESSION_COMMANDS:
         # User explicitly wants new session
         success, session_id = handle_contact_support(
             chat_id, 
@@ -1579,19 +2710,25 @@ def handle_existing_user(chat_id, message_text, user_data, channel_user):
             user_data
         )
         if success and session_id:
-            user_session_state[chat_id_str] = {
-                'in_session': True,
-                'conversation_id': conversation_id,
-                'session_id': session_id,
-                'session_status': 'Waiting'
-            }
+            set_state(
+                chat_id_str,
+                in_session=True,
+                conversation_id=conversation_id,
+                session_id=session_id,
+                session_status='Waiting'
+            )
         return success
     
-    elif message_lower in ['main menu', 'menu']:
+    elif message_lower in MAIN_MENU_COMMANDS:
         user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
         return show_main_menu(chat_id, user_name)
     
     # REGULAR MESSAGE HANDLING - SIMPLIFIED LOGIC
+    # Session lookup failed - don't treat it as "no session" and open another
+    if any_sessions is None:
+        bot_manager.send_message(chat_id, SEND_FAILED_MSG, parse_mode='Markdown')
+        return False
+    
     # ALWAYS check if there's a session first
     if has_any_session:
         # Forward message to existing session
@@ -1621,22 +2758,12 @@ def show_registration_button(chat_id):
     # Clear any existing registration state to start fresh
     registration_flow[str(chat_id)] = {'step': 'start'}
     
-    keyboard = {
-        "inline_keyboard": [
-            [{"text": "📱 Register with Phone Number", "callback_data": "register_phone"}]
-        ]
-    }
-    
-    welcome_text = """
-👋 *Welcome to Bank of Abyssinia Support!*
-
-To use our support services, please register by clicking the button below.
-    """
+    welcome_text = REGISTER_PROMPT_MSG
     
     return bot_manager.send_message(
         chat_id, 
         welcome_text, 
-        reply_markup=keyboard, 
+        reply_markup=REGISTRATION_MARKUP_JSON, 
         parse_mode='Markdown'
     )
 
@@ -1649,15 +2776,12 @@ def handle_message_without_session_proper(chat_id, message_text, user_data, chan
     is_support_request = (
         len(message_text) > 20 or 
         '?' in message_text or 
-        'help' in message_lower or 
-        'issue' in message_lower or 
-        'problem' in message_lower or 
-        'support' in message_lower
+        SUPPORT_KEYWORDS_PATTERN.search(message_lower) is not None
     )
     
     if is_support_request:
         # Create new session and forward message
-        logger.info(f"Creating new session for support request from {chat_id}")
+        logger.info("Creating new session for support request from %s", chat_id)
         
         # Create new session
         success, session_id = handle_contact_support(
@@ -1669,39 +2793,28 @@ def handle_message_without_session_proper(chat_id, message_text, user_data, chan
         
         if success and session_id:
             # Now forward the original message
-            user_session_state[chat_id_str] = {
-                'in_session': True,
-                'conversation_id': conversation_id,
-                'session_id': session_id,
-                'session_status': 'Waiting'
-            }
+            set_state(
+                chat_id_str,
+                in_session=True,
+                conversation_id=conversation_id,
+                session_id=session_id,
+                session_status='Waiting'
+            )
             
-            payload = {
-                'channelType': 'Telegram',
-                'chatId': chat_id_str,
-                'message': message_text,
-                'messageId': f"TG_{int(time.time())}",
-                'firstName': user_data.get('first_name', ''),
-                'lastName': user_data.get('last_name', ''),
-                'username': user_data.get('username', ''),
-                'languageCode': user_data.get('language_code', 'en'),
-                'conversationId': conversation_id,
-                'sessionId': session_id,
-                'isSessionStart': False
-            }
+            payload = build_forward_payload(chat_id_str, message_text, user_data, conversation_id, session_id)
             
             forward_success = bot_manager.forward_to_salesforce(payload)
             
             if forward_success:
                 bot_manager.send_message(
                     chat_id,
-                    "✅ *Message delivered. Waiting for agent to respond.*",
+                    DELIVERED_WAITING_MSG,
                     parse_mode='Markdown'
                 )
             else:
                 bot_manager.send_message(
                     chat_id,
-                    "❌ *Failed to send message. Please try again.*",
+                    SEND_FAILED_MSG,
                     parse_mode='Markdown'
                 )
             
@@ -1710,7 +2823,7 @@ def handle_message_without_session_proper(chat_id, message_text, user_data, chan
             return success
     else:
         # Show menu for short/ambiguous messages
-        logger.info(f"No session and ambiguous message from {chat_id}, showing menu")
+        logger.info("No session and ambiguous message from %s, showing menu", chat_id)
         user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
         return show_main_menu(chat_id, user_name)
 #################################
@@ -1730,26 +2843,20 @@ def handle_new_user_registration(chat_id, message_text, user_data):
         if channel_user:
             # User is already registered, show main menu
             user_name = channel_user.get('Contact__r', {}).get('FirstName') or user_data.get('first_name')
-            return show_main_menu(chat_id, user_name, has_active_session=False)
+            return show_main_menu(chat_id, user_name)
         
         # If user sent a phone number directly (without clicking button)
-        if is_phone_number(message_text):
-            clean_phone = bot_manager.clean_phone_number(message_text)
-            if clean_phone:
-                # Store phone and ask for name
-                registration_flow[chat_id_str] = {
-                    'step': 'name_requested',
-                    'phone': clean_phone
-                }
-                
-                name_request_text = """
-✅ *Phone number received!*
-
-Now, please enter your *first and last name*:
-
-Example: *John Smith*
-                """
-                return bot_manager.send_message(chat_id, name_request_text, parse_mode='Markdown')
+        clean_phone = bot_manager.clean_phone_number(message_text)
+        if clean_phone:
+            # Store phone and ask for name
+            registration_flow[chat_id_str] = {
+                'step': 'name_requested',
+                'phone': clean_phone
+            }
+            prefetch_contact_by_phone(clean_phone)
+            
+            name_request_text = NAME_REQUEST_MSG
+            return bot_manager.send_message(chat_id, name_request_text, parse_mode='Markdown')
         
         # Otherwise, show registration button
         return show_registration_button(chat_id)
@@ -1758,57 +2865,36 @@ Example: *John Smith*
     current_step = registration_state.get('step')
     
     if current_step == 'phone_requested':
-        if is_phone_number(message_text):
-            clean_phone = bot_manager.clean_phone_number(message_text)
-            
-            if not clean_phone:
-                error_text = """
-📱 *Please enter a valid Ethiopian phone number:*
-
-Example: *0912121212* or *+251912121212*
-                """
-                return bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
-            
+        # One sanitize pass both validates and normalizes the number
+        clean_phone = bot_manager.clean_phone_number(message_text)
+        if clean_phone:
             # Store phone and ask for name
             registration_flow[chat_id_str] = {
                 'step': 'name_requested',
                 'phone': clean_phone
             }
+            prefetch_contact_by_phone(clean_phone)
             
-            name_request_text = """
-✅ *Phone number received!*
-
-Now, please enter your *first and last name*:
-
-Example: *John Smith*
-            """
+            name_request_text = NAME_REQUEST_MSG
             return bot_manager.send_message(chat_id, name_request_text, parse_mode='Markdown')
         else:
             # Invalid phone number
-            error_text = """
-📱 *Please enter a valid Ethiopian phone number:*
-
-Example: *0912121212* or *+251912121212*
-            """
+            error_text = INVALID_PHONE_MSG
             return bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
     
     elif current_step == 'name_requested':
         # Validate name format
         name_parts = message_text.strip().split()
         if len(name_parts) < 2:
-            error_text = """
-📝 *Please enter both first and last name:*
-
-Example: *John Smith*
-            """
+            error_text = FULL_NAME_REQUIRED_MSG
             return bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
         
         first_name = name_parts[0].strip()
         last_name = ' '.join(name_parts[1:]).strip()
         
         # Clean names
-        safe_first_name = re.sub(r'[^\w\s\-]', '', first_name)[:40]
-        safe_last_name = re.sub(r'[^\w\s\-]', '', last_name)[:40]
+        safe_first_name = NAME_UNSAFE_PATTERN.sub('', first_name)[:40]
+        safe_last_name = NAME_UNSAFE_PATTERN.sub('', last_name)[:40]
         
         phone = registration_state.get('phone')
         
@@ -1832,28 +2918,19 @@ Example: *John Smith*
         registration_flow.pop(chat_id_str, None)
         
         if not result:
-            error_text = "❌ *Sorry, there was an error creating your account. Please try again.*"
-            return bot_manager.send_message(chat_id, error_text, parse_mode='Markdown')
+            return bot_manager.send_message(chat_id, ACCOUNT_CREATE_FAILED_MSG, parse_mode='Markdown')
         
         # Show welcome message
         if contact:
             contact_name = contact.get('FirstName', 'Customer')
-            welcome_text = f"""
-✅ *Welcome back, {contact_name}!*
-
-You're now registered in our support system.
-            """
+            welcome_text = REGISTERED_WELCOME_BACK_MSG.format(name=contact_name)
         else:
-            welcome_text = f"""
-✅ *Registration Successful!*
-
-Welcome *{safe_first_name} {safe_last_name}*, you're now connected to our support system.
-            """
+            welcome_text = REGISTRATION_SUCCESS_MSG.format(first_name=safe_first_name, last_name=safe_last_name)
         
         bot_manager.send_message(chat_id, welcome_text, parse_mode='Markdown')
         
         # Show main menu
-        return show_main_menu(chat_id, safe_first_name, has_active_session=False)
+        return show_main_menu(chat_id, safe_first_name)
     
     else:
         # Default: show registration button
@@ -1890,15 +2967,16 @@ def send_to_user():
         
         # IMPORTANT: Clear any session state that might block message delivery
         # This ensures Salesforce can always send messages
-        if safe_chat_id in user_session_state:
-            # Update session status if provided
-            session_status = data.get('session_status')
-            if session_status:
-                user_session_state[safe_chat_id]['session_status'] = session_status
+        # Update session status if provided
+        session_status = data.get('session_status')
+        if session_status:
+            state = update_state(safe_chat_id, session_status=session_status)
+            if state is not None:
+                invalidate_user_context(safe_chat_id, state.get('conversation_id'))
         
         # Validate parse_mode
         parse_mode = data.get('parse_mode', 'HTML')
-        if parse_mode not in ['HTML', 'Markdown', 'MarkdownV2']:
+        if parse_mode not in ALLOWED_PARSE_MODES:
             parse_mode = 'HTML'
         
         success = bot_manager.send_message(chat_id, safe_message, parse_mode=parse_mode)
@@ -1932,11 +3010,7 @@ def is_valid_url(url):
 def send_promotion_photo(chat_id, photo_url, caption=None, buttons=None):
     """Send photo promotion with caption and buttons"""
     try:
-        if not BOT_TOKEN:
-            logger.error("BOT_TOKEN not configured")
-            return False
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto"
+        url = TELEGRAM_SEND_PHOTO_URL
         data = {
             'chat_id': chat_id,
             'photo': photo_url,
@@ -1950,13 +3024,14 @@ def send_promotion_photo(chat_id, photo_url, caption=None, buttons=None):
         if buttons:
             keyboard = build_inline_keyboard(buttons)
             if keyboard:
-                data['reply_markup'] = json.dumps({'inline_keyboard': keyboard})
+                data['reply_markup'] = serialize_reply_markup({'inline_keyboard': keyboard})
         
-        response = requests.post(url, data=data, timeout=30)
-        result = response.json()
+        throttle_telegram_send(chat_id)
+        response = http_session.post(url, data=data, timeout=30)
+        result = orjson.loads(response.content)
         
         if result.get('ok'):
-            logger.debug(f"Photo promotion sent to {chat_id}")
+            logger.debug("Photo promotion sent to %s", chat_id)
             return True
         else:
             logger.error(f"Failed to send photo to {chat_id}: {result.get('description')}")
@@ -1969,11 +3044,7 @@ def send_promotion_photo(chat_id, photo_url, caption=None, buttons=None):
 def send_promotion_text(chat_id, text, buttons=None):
     """Send text promotion with optional buttons"""
     try:
-        if not BOT_TOKEN:
-            logger.error("BOT_TOKEN not configured")
-            return False
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+        url = TELEGRAM_SEND_URL
         data = {
             'chat_id': chat_id,
             'text': text,
@@ -1984,13 +3055,14 @@ def send_promotion_text(chat_id, text, buttons=None):
         if buttons:
             keyboard = build_inline_keyboard(buttons)
             if keyboard:
-                data['reply_markup'] = json.dumps({'inline_keyboard': keyboard})
+                data['reply_markup'] = serialize_reply_markup({'inline_keyboard': keyboard})
         
-        response = requests.post(url, data=data, timeout=30)
-        result = response.json()
+        throttle_telegram_send(chat_id)
+        response = http_session.post(url, data=data, timeout=30)
+        result = orjson.loads(response.content)
         
         if result.get('ok'):
-            logger.debug(f"Text promotion sent to {chat_id}")
+            logger.debug("Text promotion sent to %s", chat_id)
             return True
         else:
             logger.error(f"Failed to send text to {chat_id}: {result.get('description')}")
@@ -2102,7 +3174,7 @@ def validate_attachment_url(url):
 def check_attachment_size(url):
     """Check attachment size before sending"""
     try:
-        head_response = requests.head(url, timeout=5, allow_redirects=True)
+        head_response = http_session.head(url, timeout=5, allow_redirects=True)
         content_length = head_response.headers.get('content-length')
         
         if content_length:
@@ -2190,17 +3262,9 @@ def send_bulk_promotion():
         
         logger.info(f"Starting bulk promotion to {len(chat_ids)} users, campaign: {campaign_id}")
         
-        # Send messages with smart rate limiting
+        # Sends are paced by throttle_telegram_send, shared with regular replies
         for i, chat_id in enumerate(chat_ids):
             try:
-                # Smart rate limiting for bulk sends
-                if i > 0:
-                    # Telegram has limits: 30 messages/second to different chats
-                    if i % 25 == 0:  # Conservative: 25 messages then pause
-                        time.sleep(1)
-                    elif i % 5 == 0:  # Small pause every 5 messages
-                        time.sleep(0.1)
-                
                 # Validate chat_id
                 chat_id_str = str(chat_id)
                 if not chat_id_str.isdigit():
@@ -2285,24 +3349,39 @@ def telegram_webhook():
             logger.warning(f"Invalid Telegram payload: {error_msg}")
             return jsonify({'error': error_msg}), 400
         
+        # Non-200 makes Telegram hold the update and redeliver it later
+        if update_backlog_full():
+            return jsonify({'error': 'Busy, retry later'}), 503
+        
+        # Telegram redelivers updates it thinks we missed
+        if not claim_update(update_data['update_id']):
+            logger.info(f"Dropping duplicate update {update_data['update_id']}")
+            return jsonify({'status': 'ok'})
+        
         # Handle callback queries (button presses)
         if 'callback_query' in update_data:
-            handle_callback_query(update_data['callback_query'])
+            callback_query = update_data['callback_query']
+            chat_id = callback_query.get('message', {}).get('chat', {}).get('id', 0)
+            dispatch_update(chat_id, handle_callback_query, callback_query)
+            return jsonify({'status': 'ok'})
+        
+        # Edits, reactions, member updates and non-text messages need no handling
+        if 'text' not in update_data.get('message', {}):
             return jsonify({'status': 'ok'})
         
         # Handle regular messages
-        if 'message' in update_data:
-            message = update_data['message']
-            chat_id = message['chat']['id']
-            message_text = message.get('text', '')
-            user_data = message.get('from', {})
-            
-            # Log incoming message
+        message = update_data['message']
+        chat_id = message['chat']['id']
+        message_text = message['text']
+        user_data = message.get('from', {})
+        
+        # Log incoming message; the preview is only built if INFO is enabled
+        if logger.isEnabledFor(logging.INFO):
             msg_preview = message_text[:50] + '...' if len(message_text) > 50 else message_text
-            logger.info(f"Telegram message from {chat_id}: {msg_preview}")
-            
-            # Process the message
-            process_incoming_message(chat_id, message_text, user_data)
+            logger.info("Telegram message from %s: %s", chat_id, msg_preview)
+        
+        # Process the message off the request thread so Telegram gets its 200 immediately
+        dispatch_update(chat_id, process_incoming_message, chat_id, message_text, user_data)
         
         return jsonify({'status': 'ok'})
             
@@ -2314,16 +3393,13 @@ def telegram_webhook():
 def set_webhook():
     """Set Telegram webhook programmatically"""
     try:
-        if not BOT_TOKEN:
-            return jsonify({'error': 'BOT_TOKEN not configured'}), 500
-            
         webhook_url = f"https://{request.host}/webhook"
-        set_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook?url={webhook_url}"
+        set_url = f"{TELEGRAM_API_BASE}/setWebhook?url={webhook_url}"
         
         logger.info(f"Setting webhook to: {webhook_url}")
         
-        response = requests.get(set_url)
-        result = response.json()
+        response = http_session.get(set_url, timeout=10)
+        result = orjson.loads(response.content)
         
         if result.get('ok'):
             return jsonify({
@@ -2348,8 +3424,7 @@ def clear_session_state(chat_id):
     if not chat_id.isdigit():
         return jsonify({'error': 'Invalid chat ID format'}), 400
     
-    if chat_id in user_session_state:
-        del user_session_state[chat_id]
+    if clear_state(chat_id):
         return jsonify({'status': 'success', 'message': f'Cleared session state for {chat_id}'})
     
     return jsonify({'status': 'error', 'message': 'No session state found'}), 404
@@ -2360,7 +3435,7 @@ def get_session_state(chat_id):
     if not chat_id.isdigit():
         return jsonify({'error': 'Invalid chat ID format'}), 400
     
-    state = user_session_state.get(chat_id, {})
+    state = get_state(chat_id)
     return jsonify({'status': 'success', 'state': state})
 
 # ============================================
@@ -2382,10 +3457,11 @@ def security_metrics():
         }
         
         # Get session stats
+        session_states = user_session_state.values()
         session_stats = {
-            'total_sessions': len(user_session_state),
-            'active_sessions': sum(1 for s in user_session_state.values() if s.get('in_session')),
-            'waiting_sessions': sum(1 for s in user_session_state.values() if s.get('session_status') == 'Waiting')
+            'total_sessions': len(session_states),
+            'active_sessions': sum(1 for s in session_states if s.get('in_session')),
+            'waiting_sessions': sum(1 for s in session_states if s.get('session_status') == 'Waiting')
         }
         
         # System health
@@ -2458,14 +3534,12 @@ def test_registration(phone):
 def test_conversation(telegram_id):
     """Test conversation endpoint"""
     try:
-        # Find channel user
-        channel_user = bot_manager.check_existing_channel_user(telegram_id)
+        # Find channel user and conversation
+        channel_user, conversation = bot_manager.get_channel_user_and_active_conversation(telegram_id)
         
         if not channel_user:
             return jsonify({'error': 'Channel user not found'}), 404
         
-        # Get conversation
-        conversation = bot_manager.get_active_support_conversation(channel_user['Id'])
         
         if conversation:
             return jsonify({
@@ -2521,10 +3595,13 @@ def test():
 def health_check():
     """Enhanced health check with security status"""
     try:
-        access_token = bot_manager.sf_auth.get_access_token()
+        sf_connected = health_status_cache.get('salesforce')
+        if sf_connected is None:
+            sf_connected = bool(bot_manager.sf_auth.get_access_token())
+            health_status_cache.set('salesforce', sf_connected)
         
         health_status = {
-            'status': 'healthy' if BOT_TOKEN and access_token else 'degraded',
+            'status': 'healthy' if BOT_TOKEN and sf_connected else 'degraded',
             'service': 'telegram-salesforce-bot',
             'version': '5.0-security',
             'timestamp': datetime.now().isoformat(),
@@ -2534,8 +3611,8 @@ def health_check():
                 'request_timeout': REQUEST_TIMEOUT
             },
             'telegram_bot': 'configured' if BOT_TOKEN else 'missing',
-            'salesforce_connection': 'connected' if access_token else 'disconnected',
-            'session_state_count': len(user_session_state),
+            'salesforce_connection': 'connected' if sf_connected else 'disconnected',
+            'update_backlog': update_backlog,
             'rate_limiting_active_ips': len(rate_limiter.requests)
         }
         
@@ -2569,10 +3646,7 @@ if __name__ == '__main__':
     logger.info("🚀 Starting Telegram Bot v5.0 (Security Enhanced)")
     logger.info("=" * 70)
     
-    if missing_vars:
-        logger.error(f"Missing environment variables: {', '.join(missing_vars)}")
-    else:
-        logger.info("✅ All environment variables are set")
+    logger.info("✅ All environment variables are set")
     
     logger.info(f"📱 Channel Type: Telegram")
     logger.info(f"🔒 Security Features:")
@@ -2582,4 +3656,8 @@ if __name__ == '__main__':
     logger.info(f"   • Request Timeout: {REQUEST_TIMEOUT}s")
     logger.info(f"🌐 Starting server on port {PORT}")
     
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    if USE_GEVENT:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', PORT), app).serve_forever()
+    else:
+        app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
\ No newline at end of file
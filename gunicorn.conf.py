@@ -4,9 +4,14 @@ import os
 bind = "0.0.0.0:{}".format(int(os.environ.get("PORT", 5000)))
 
 # Worker processes
-workers = 4
-worker_class = "sync"
-worker_connections = 1000
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+# Threaded workers so webhooks blocked on Salesforce/Telegram I/O don't
+# hold up the rest of the worker. Set GUNICORN_WORKER_CLASS=gevent to use
+# cooperative workers instead; each then serves up to
+# GUNICORN_WORKER_CONNECTIONS concurrent requests.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
 timeout = 120
 keepalive = 2
 